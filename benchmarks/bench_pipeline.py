@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_pipeline.py
+
+Замер этапов конвейера на синтетических проектах (см. synthetic.py) разного
+размера, по умолчанию 10, 100 и 1000 сертификатов.
+
+Для каждого размера создаётся временный проект, и этапы запускаются с общим
+контекстом, как в start.py, но в порядке, в котором у каждого этапа есть
+входные данные:
+  2_journal.main -> 3_situacija -> 4_izvedeno.main -> кумулятивный отчёт ->
+  1_journal_update -> запись журнала (flush)
+Затем тот же проект прогоняется второй раз без изменений ("warm"): так видно,
+сколько стоит инкрементальный запуск.
+
+Вывод этапов подавляется; печатается таблица времён (секунды), при --json
+результаты сохраняются в файл.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 10 100 --items 60 --workers 4 --json bench.json
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from synthetic import SCRIPTS_DIR, make_project
+
+from pipeline_context import PipelineContext  # noqa: E402  (scripts в sys.path через synthetic)
+
+STAGES = [
+    ("2_journal", "2_journal.py", "main"),
+    ("3_situacija", "3_situacija.py", "fill_situacija_reports_com"),
+    ("4_izvedeno", "4_izvedeno.py", "main"),
+    ("5_kumulativni", "5_kumulativni izveštaj.py", "create_kumulativni_izveštaj"),
+    ("1_journal_update", "1_journal_update.py", "update_journal_total_amount_din"),
+]
+
+
+def load_stage(file_name: str, func_name: str):
+    """Загружает скрипт этапа так же, как start.py (с регистрацией в sys.modules)."""
+    path = SCRIPTS_DIR / file_name
+    spec = importlib.util.spec_from_file_location(path.stem, str(path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return getattr(module, func_name)
+
+
+def run_pipeline(root: Path, funcs) -> dict:
+    """Один прогон всех этапов; возвращает {этап: секунды}."""
+    timings = {}
+    ctx = PipelineContext(root)
+    sink = io.StringIO()
+    for name, func in funcs:
+        t0 = time.perf_counter()
+        with redirect_stdout(sink):
+            func(ctx)
+        timings[name] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ctx.flush()
+    timings["flush"] = time.perf_counter() - t0
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+def bench_size(size: int, items: int, funcs, workdir: Path, keep: bool) -> dict:
+    root = workdir / f"project_{size}"
+    t0 = time.perf_counter()
+    make_project(root, size, items)
+    result = {"certificates": size, "items": items, "generate": time.perf_counter() - t0}
+    try:
+        result["cold"] = run_pipeline(root, funcs)
+        result["warm"] = run_pipeline(root, funcs)
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def print_table(results):
+    columns = [name for name, *_ in STAGES] + ["flush", "total"]
+    print(f"{'certs':>6} {'run':<5} " + " ".join(f"{c:>16}" for c in columns))
+    for res in results:
+        for run in ("cold", "warm"):
+            row = " ".join(f"{res[run][c]:>16.3f}" for c in columns)
+            print(f"{res['certificates']:>6} {run:<5} {row}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="числа сертификатов (по умолчанию 10 100 1000)")
+    parser.add_argument("--items", type=int, default=40, help="позиций в сертификате")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="процессов для 4_izvedeno (MATIC_WORKERS)")
+    parser.add_argument("--workdir", type=Path, default=None,
+                        help="папка для проектов (по умолчанию временная)")
+    parser.add_argument("--keep", action="store_true", help="не удалять созданные проекты")
+    parser.add_argument("--json", type=Path, default=None, help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    if args.workers is not None:
+        os.environ["MATIC_WORKERS"] = str(args.workers)
+
+    funcs = [(name, load_stage(file_name, func)) for name, file_name, func in STAGES]
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="matic_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        print(f"-> {size} certificates x {args.items} items ...", flush=True)
+        results.append(bench_size(size, args.items, funcs, workdir, args.keep))
+
+    print()
+    print_table(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\nResults saved to {args.json}")
+    if args.keep:
+        print(f"Projects kept in {workdir}")
+    elif args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+synthetic.py
+
+Генератор синтетического проекта для бенчмарков:
+  - templates/ — шаблоны situacija и izvedeno из matic/templates (журнала нет,
+    проект начинается с пустого journal.sqlite3)
+  - Input/ — N сертификатов Progress_certificate с M позициями каждый
+
+Сертификаты устроены как выгрузка с платформы:
+  - имя '<проект>_Progress_certificate_<номер>_<дд.мм.гггг>.xlsx' (разбирается
+    parse_filename из 2_journal), даты идут по одной в день
+  - лист 'Completion certificate' с теми же столбцами, что у образца, строкой
+    'Radovi', позициями работ, строкой 'RADOVI PO PONUDI' и строкой
+    'Izvođenje radova po zahtevu Naručioca' (часы для [extra_hours])
+  - первые позиции названы ключами из столбца B шаблона izvedeno, так что
+    4_izvedeno находит для тегов [data] значения в столбце E; остальные
+    позиции ('Pozicija N') ни с чем не совпадают
+"""
+import random
+import shutil
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+from openpyxl import Workbook
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = REPO_ROOT / "matic" / "scripts"
+TEMPLATES_DIR = REPO_ROOT / "matic" / "templates"
+TEMPLATE_NAMES = ("situacija_template.xlsx", "izvedeno_template.xlsx")
+
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from template_compiler import compile_template  # noqa: E402
+
+HEADER = [
+    "Name", "Unit", "Rate with VAT", "Quantity in contract", "Quantity in certificate",
+    "Accepted quantity", "Quantity to accept", "Amount in contract with VAT",
+    "Amount in certificate with VAT", "Accepted amount with VAT", "Amount to accept with VAT",
+]
+EXTRA_HOURS_NAME = "Izvođenje radova po zahtevu Naručioca"
+PROJECT_PREFIX = "Novi_Sad_Delta_Iron"
+
+
+def template_keys(template_fp: Path = TEMPLATES_DIR / "izvedeno_template.xlsx"):
+    """Ключи из столбца B у ячеек [data] шаблона izvedeno, в порядке шаблона."""
+    tmap = compile_template(template_fp, ["[data]"])
+    return list(dict.fromkeys(
+        loc["key"] for loc in tmap["cells"] if isinstance(loc["key"], str)
+    ))
+
+
+def certificate_name(index: int, cert_date: date) -> str:
+    return f"{PROJECT_PREFIX}_Progress_certificate_{index:04d}-1_{cert_date:%d.%m.%Y}.xlsx"
+
+
+def write_certificate(path: Path, items: int, keys, rng: random.Random):
+    """Один сертификат с items позициями; суммы — случайные, с двумя знаками."""
+    rows = []
+    for i in range(items):
+        # Сначала позиции с ключами шаблона, остальные — без совпадений
+        name = keys[i] if i < len(keys) else f"Pozicija {i + 1}"
+        rate = round(rng.uniform(0.3, 80), 2)
+        qty = round(rng.uniform(1, 1000), 2)
+        amount = round(rate * qty, 2)
+        rows.append([name, "m³", rate, round(qty * 2, 2), qty, qty, 0,
+                     round(amount * 2, 2), amount, amount, 0])
+
+    hours = rng.randint(1, 500)
+    extra_amount = round(hours * 11.5, 2)
+    works_total = round(sum(r[8] for r in rows), 2)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Completion certificate")
+    ws.append(HEADER)
+    ws.append(["Radovi", "", None, None, None, None, None,
+               round(works_total * 2, 2), works_total, works_total, 0])
+    for row in rows:
+        ws.append(row)
+    ws.append(["RADOVI PO PONUDI", "", None, None, None, None, None,
+               extra_amount, extra_amount, extra_amount, 0])
+    ws.append([EXTRA_HOURS_NAME, "h", 11.5, hours, hours, hours, 0,
+               extra_amount, extra_amount, extra_amount, 0])
+    accept = wb.create_sheet("Position to accept")
+    accept.append(["Name", "Unit", "Rate with VAT", "Quantity to accept", "Amount to accept with VAT"])
+    wb.save(path)
+
+
+def make_project(root: Path, certificates: int, items: int = 40, seed: int = 0,
+                 start: date = date(2025, 1, 1)) -> Path:
+    """Создаёт в root проект с шаблонами и certificates сертификатами в Input."""
+    root = Path(root)
+    (root / "templates").mkdir(parents=True, exist_ok=True)
+    (root / "Input").mkdir(parents=True, exist_ok=True)
+    for name in TEMPLATE_NAMES:
+        shutil.copy2(TEMPLATES_DIR / name, root / "templates" / name)
+
+    rng = random.Random(seed)
+    keys = template_keys()
+    for i in range(certificates):
+        cert_date = start + timedelta(days=i)
+        write_certificate(root / "Input" / certificate_name(i + 1, cert_date), items, keys, rng)
+    return root
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Синтетический проект для бенчмарков")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("-n", "--certificates", type=int, default=10)
+    parser.add_argument("-m", "--items", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_project(args.root, args.certificates, args.items, args.seed)
+    print(f"✅ {args.certificates} certificates written to {args.root / 'Input'}")
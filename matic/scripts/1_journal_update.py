@@ -1,50 +1,101 @@
 #!/usr/bin/env python3
 """
-Обновляет в journal.xlsx колонку "Total Amount Din" значениями из ячейки D32
-каждого соответствующего файла situacija в папке Output/Situacija.
+Обновляет в журнале (templates/journal.sqlite3) курсы и колонку "Total Amount Din".
+
+Курсы берутся из таблицы курсов (templates/exchange_rates.csv, exchange_rates),
+а для дат, которых в ней нет, — из ячеек курсов файла situacija в папке
+Output/Situacija, куда курс вводится вручную. Сумма в динарах (D32) не читается
+из отчёта (её сохраняет только Excel после пересчёта), а вычисляется по формулам
+шаблона для всего журнала одним пакетом (situacija_totals, formula_eval).
+Файлы, не изменившиеся с прошлого чтения (build_manifest), повторно не читаются;
+остальные читаются заранее в потоках (io_pipeline.prefetch).
 Скрипт находится в папке scripts внутри корня проекта.
 """
-import sys
-import pandas as pd
-from pathlib import Path
-from openpyxl import load_workbook
+import numpy as np
 
-def update_journal_total_amount_din():
-    # Определяем корень проекта: скрипт всегда лежит в <root>/scripts
-    scripts_dir = Path(__file__).resolve().parent
-    root = scripts_dir.parent
+from build_manifest import BuildManifest, row_version
+from io_pipeline import prefetch
+from pipeline_context import resolve_context
+from run_metrics import file_timer
+from situacija_totals import TAG_COLUMNS, dinar_updates, parse_rate, rate_cells, table_rates, template_path
+from xlsx_cells import read_cells
 
-    templates_dir = root / "templates"
-    situacija_dir = root / "Output" / "Situacija"
-    journal_fp = templates_dir / "journal.xlsx"
 
-    if not journal_fp.exists():
-        print(f"❌ Файл журнала не найден: {journal_fp}", file=sys.stderr)
-        sys.exit(1)
+def update_journal_total_amount_din(ctx=None):
+    # Корень проекта берётся из контекста; без него — родитель папки scripts
+    ctx, own_ctx = resolve_context(ctx, __file__)
+    root = ctx.root
 
-    # Загружаем журнал
-    df = pd.read_excel(journal_fp)
+    situacija_dir = root / "Output" / "Situacija"
 
-    # Добавляем колонку, если её нет
-    if "Total Amount Din" not in df.columns:
-        df["Total Amount Din"] = None
+    # Строки журнала из общего контекста (без загрузки pandas)
+    rows = ctx.journal_records()
+    manifest = BuildManifest(root)
+    template_fp = template_path(root)
+    if not rows or not template_fp.exists():
+        print("✅ Journal updated: 0 rows")
+        return
 
-    # Обновляем значения
-    for idx, row in df.iterrows():
-        invoice_name = row.get("Invoice")
-        report_fp = situacija_dir / invoice_name
+    # Курсы по таблице курсов — для всего журнала за один проход
+    advance_rates, bill_rates = table_rates(ctx, rows)
+    from_table = int(np.sum(~np.isnan(advance_rates) & ~np.isnan(bill_rates)))
 
+    # Для дат без курса в таблице — курсы, введённые вручную в situacija
+    # (ранее прочитанные — из журнала)
+    cells = rate_cells(ctx.template_map(template_fp, TAG_COLUMNS))
+    reports = []
+    for i, row in enumerate(rows):
+        if not (np.isnan(advance_rates[i]) or np.isnan(bill_rates[i])):
+            continue
+        advance_rates[i] = parse_rate(row.get("Advance Rate"))
+        bill_rates[i] = parse_rate(row.get("Total Rate"))
+        report_fp = situacija_dir / row.get("Invoice")
         if not report_fp.exists():
             print(f"⚠ Report not found: {report_fp}")
             continue
+        reports.append((i, report_fp))
+
+    # Хэши отчётов считаются заранее в потоках (io_pipeline)
+    stale = []
+    for (i, report_fp), report_hash in prefetch(reports, lambda r: manifest.fingerprint(r[1])):
+        # Пропускаем, если situacija не менялась и значение в журнале то же
+        key = f"journal:{rows[i].get('Invoice')}"
+        current = rows[i].get("Total Amount Din")
+        if not manifest.up_to_date(key, {"situacija": report_hash, "value": row_version({"din": current})}):
+            stale.append((i, report_fp, key, report_hash))
+
+    def read_rates(item):
+        report_fp = item[1]
+        # Читаем только ячейки курсов, без загрузки всей книги; результаты
+        # формул (сохраняемые только Excel) не нужны
+        with file_timer("read", report_fp):
+            return read_cells(report_fp, list(cells.values()))
+
+    # Следующие отчёты читаются, пока обрабатывается текущий
+    records = {}
+    for (i, _, key, report_hash), values in prefetch(stale, read_rates):
+        advance_rates[i] = parse_rate(values.get(cells.get("[advance_rate_exchange]")))
+        bill_rates[i] = parse_rate(values.get(cells.get("[bill_rate_exchange]")))
+        records[key] = (i, report_hash)
 
-        wb = load_workbook(report_fp, data_only=True)
-        ws = wb.active
-        df.at[idx, "Total Amount Din"] = ws["D32"].value
+    # Итоги situacija по формулам шаблона — для всех строк сразу (situacija_totals)
+    updates = dinar_updates(ctx, rows, advance_rates, bill_rates)
+    records = {
+        key: {
+            "situacija": report_hash,
+            "value": row_version({"din": updates.get(rows[i].get("Invoice"), rows[i]).get("Total Amount Din")}),
+        }
+        for key, (i, report_hash) in records.items()
+    }
 
-    # Сохраняем изменения
-    df.to_excel(journal_fp, index=False)
-    print(f"✅ Journal updated: {journal_fp}")
+    # Изменения попадают в журнал контекста и записываются при flush()
+    ctx.update_journal(updates)
+    if own_ctx:
+        ctx.flush()
+    for key, inputs in records.items():
+        manifest.record(key, inputs)
+    manifest.save()
+    print(f"✅ Journal updated: {len(updates)} rows ({from_table} rows with rates from the exchange-rate table)")
 
 if __name__ == "__main__":
     update_journal_total_amount_din()
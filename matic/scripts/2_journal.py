@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 """
 Обрабатывает новые файлы из папки Input:
+  - Сначала быстро проверяет все новые файлы параллельно (preflight): имя,
+    архив, листы и заголовок; отклонённые с причиной пропускаются до разбора
   - Парсит имя файла для получения номера и даты сертификата
-  - Суммирует суммы по столбцу "Amount in certificate with VAT"
+  - Пропускает файлы, содержимое которых совпадает с уже обработанными
+    (переименованные копии; сравнение по хэшу, certificate_cache)
+  - Суммирует суммы по столбцу "Amount in certificate with VAT" (столбцы Name и
+    сумм берутся из нормализованного сертификата общего контекста; отдельно —
+    через calamine, если он установлен)
+  - Берёт курс евро на дату сертификата и на дату аванса из таблицы курсов
+    (exchange_rates) и считает сумму в динарах по формулам шаблона situacija
+    (situacija_totals)
   - Копирует шаблоны Situacija и Izvedeno, заполняет их (TODO)
-  - Ведёт журнал в templates/journal.xlsx
+  - Добавляет строки в журнал общего контекста (pipeline_context); журнал
+    записывается в templates/journal.sqlite3 в конце запуска, journal.xlsx
+    выгружается только по запросу
 Скрипт находится в папке scripts внутри корня проекта.
 """
 import sys
@@ -12,54 +23,54 @@ from pathlib import Path
 import pandas as pd
 import shutil
 
+from pipeline_context import resolve_context
+from preflight import parse_filename, preflight
+from situacija_totals import dinar_updates, table_rates
 
-def get_processed_files(journal_path: Path):
-    cols = [
-        "Source File",
-        "Certificate Number",
-        "Certificate Date",
-        "Total Amount",
-        "Advance Rate",
-        "Total Rate",
-        "Total Amount Din",
-        "Invoice",
-        "Certificate"
-    ]
-    if journal_path.exists():
-        df = pd.read_excel(journal_path)
-        missing = [c for c in cols if c not in df.columns]
-        if missing:
-            print(f"⚠ Warning: journal exists but missing columns: {missing}. Reinitializing journal.")
-            df = pd.DataFrame(columns=cols)
-    else:
-        df = pd.DataFrame(columns=cols)
-    processed = set(df["Source File"].astype(str).tolist())
-    return processed, df
-
-
-def parse_filename(fn: str):
-    stem = Path(fn).stem
-    if "_Progress_certificate_" not in stem:
-        raise ValueError(f"Unexpected filename format: {fn}")
-    _, rest = stem.split("_Progress_certificate_", 1)
-    parts = rest.split("_", 1)
-    return parts[0], parts[1]
-
-
-def extract_total_amount(input_path: Path):
-    df = pd.read_excel(input_path, sheet_name="Completion certificate")
+
+AMOUNT_SHEET = "Completion certificate"
+AMOUNT_COLUMNS = ["Name", "Amount in certificate with VAT"]
+
+
+def excel_engine():
+    """Движок чтения xlsx: calamine, если установлен python-calamine, иначе по умолчанию pandas."""
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    return "calamine"
+
+
+def read_amount_columns(input_path: Path) -> pd.DataFrame:
+    """Читает с листа сертификата только столбцы Name и сумм."""
+    return pd.read_excel(
+        input_path, sheet_name=AMOUNT_SHEET, usecols=AMOUNT_COLUMNS, engine=excel_engine()
+    )
+
+
+def parse_amounts(values: pd.Series) -> pd.Series:
+    """
+    Суммы в числа по тем же правилам, что и раньше: пробелы и запятые
+    (разделители тысяч) удаляются, остальное — число; иначе ValueError.
+    """
+    cleaned = (
+        values.astype(str)
+        .str.strip()
+        .str.replace(" ", "", regex=False)
+        .str.replace(",", "", regex=False)
+    )
+    return pd.to_numeric(cleaned, errors="raise").astype(float)
+
+
+def extract_total_amount(input_path: Path, df: pd.DataFrame = None):
+    if df is None:
+        df = read_amount_columns(input_path)
     mask = df["Name"].astype(str).str.strip().isin(["Radovi", "RADOVI PO PONUDI"])
     if not mask.any():
         raise ValueError(f"Rows 'Radovi' or 'RADOVI PO PONUDI' not found in {input_path.name}")
-    total = 0.0
-    for raw in df.loc[mask, "Amount in certificate with VAT"]:
-        s = str(raw).replace(" ", "").replace(",", "")
-        try:
-            val = float(s)
-        except ValueError:
-            val = float(s.replace(",", "."))
-        total += val
-    return total
+    amounts = parse_amounts(df.loc[mask, "Amount in certificate with VAT"])
+    # Складываем по порядку, как раньше: пропуск в сумме даёт nan
+    return sum(amounts.tolist(), 0.0)
 
 
 def get_next_index(folder: Path, prefix: str):
@@ -71,16 +82,15 @@ def get_next_index(folder: Path, prefix: str):
     return max(nums) + 1 if nums else 1
 
 
-def main():
-    # Определяем корень проекта из расположения скрипта
-    scripts_dir = Path(__file__).resolve().parent
-    root = scripts_dir.parent
+def main(ctx=None):
+    # Корень проекта берётся из контекста; без него — из расположения скрипта
+    ctx, own_ctx = resolve_context(ctx, __file__)
+    root = ctx.root
 
     input_dir  = root / "Input"
     out_sit    = root / "Output" / "Situacija"
     out_izv    = root / "Output" / "Izvedeno"
     templates  = root / "templates"
-    journal_fp = templates / "journal.xlsx"
 
     # Создаём папки, если нужно
     for d in (input_dir, out_sit, out_izv, templates):
@@ -92,23 +102,43 @@ def main():
     print(f"Izvedeno output:   {out_izv}")
     print(f"Templates folder:  {templates}\n")
 
-    processed, journal_df = get_processed_files(journal_fp)
-    print(f"Already processed: {len(processed)} files in journal")
+    print(f"Already processed: {len(ctx.journal)} files in journal")
 
     all_files = sorted(input_dir.glob("*.xlsx"))
-    new_files = [f for f in all_files if f.name not in processed]
+    new_files = [f for f in all_files if not ctx.is_processed(f.name)]
     print(f"Found {len(all_files)} files, {len(new_files)} new\n")
 
+    # Быстрая проверка до разбора: битые и чужие файлы отсеиваются сразу
+    rejected = preflight(new_files)
+    for r in rejected:
+        print(f"-> REJECTED {r['file']}: {r['reason']} ({r['detail']})")
+    if rejected:
+        skipped = {r["file"] for r in rejected}
+        new_files = [f for f in new_files if f.name not in skipped]
+        print(f"Pre-flight: {len(rejected)} files rejected, {len(new_files)} to process\n")
+
     next_idx = get_next_index(out_sit, "situacija")
 
+    # Хэши содержимого уже обработанных файлов: переименованная копия
+    # сертификата не должна попасть в журнал второй раз
+    cache = ctx.certificate_cache
+    seen = {}
+    for f in all_files:
+        if ctx.is_processed(f.name):
+            seen.setdefault(cache.content_hash(f), f.name)
+
     for src in new_files:
         fn = src.name
         print(f"-> Processing {fn} ...", end=" ")
+        digest = cache.content_hash(src)
+        if digest in seen:
+            print(f"DUPLICATE of {seen[digest]}, skipped")
+            continue
         try:
             cert_num, cert_date = parse_filename(fn)
-            total_eur = extract_total_amount(src)
+            total_eur = extract_total_amount(src, ctx.certificate_frame(src))
 
-            # TODO: расчёт курсов и суммы в дин.
+            # Курсы и сумма в дин. — после добавления всех файлов, по таблице курсов
             advance_rate = None
             total_rate   = None
             total_din    = None
@@ -124,7 +154,8 @@ def main():
             # shutil.copy(templates/"izvedeno_template.xlsx", out_izv/cert_fn)
             # затем openpyxl для вставки данных
 
-            journal_df.loc[len(journal_df)] = {
+            seen[digest] = fn
+            ctx.append_journal({
                 "Source File":        fn,
                 "Certificate Number": cert_num,
                 "Certificate Date":   cert_date,
@@ -134,13 +165,21 @@ def main():
                 "Total Amount Din":   total_din,
                 "Invoice":            invoice_fn,
                 "Certificate":        cert_fn
-            }
+            })
             print("OK")
         except Exception as e:
             print(f"ERROR: {e}")
 
-    journal_df.to_excel(journal_fp, index=False)
-    print(f"\nJournal saved to {journal_fp}")
+    # Курсы и суммы в динарах новых строк: по таблице курсов и формулам шаблона
+    # situacija, для всего журнала одним пакетом (без курса — вводятся вручную)
+    if new_files:
+        rows = ctx.journal_records()
+        advance_rates, bill_rates = table_rates(ctx, rows)
+        ctx.update_journal(dinar_updates(ctx, rows, advance_rates, bill_rates))
+
+    if own_ctx:
+        ctx.flush()
+        print("\nJournal saved")
     print("=== Done ===")
 
 if __name__ == "__main__":
@@ -1,96 +1,187 @@
 #!/usr/bin/env python3
 """
 Автоматически заполняет отчёты Situacija по журналу:
-  - Читает journal.xlsx из templates
-  - Вычисляет кумулятивные суммы
-  - Находит или копирует шаблон situacija_template.xlsx
-  - Заменяет теги в Excel через COM
+  - Берёт журнал из общего контекста конвейера (pipeline_context)
+  - Берёт предыдущие и кумулятивные суммы из книги нарастающих итогов
+    (running_ledger) вместо сортировки и cumsum по всему журналу; отчёты,
+    чьи предыдущие суммы изменила вставка задним числом, пересобираются
+    из шаблона
+  - Подставляет курсы евро из журнала (таблица курсов, exchange_rates); без
+    курса теги курсов остаются для ручного ввода, а курсы, уже введённые
+    вручную, переносятся в отчёт, пересобираемый из шаблона
+  - Находит отчёт или создаёт новый из шаблона situacija_template.xlsx,
+    разобранного один раз и клонируемого в памяти (xlsx_clone)
+  - Пропускает отчёты, у которых не изменились шаблон и значения строки журнала
+    (build_manifest)
+  - Заменяет теги прямо в XML книги (xlsx_tags), без запуска Excel; в новых
+    отчётах — только в местах, известных по карте тегов шаблона
+    (template_compiler), в готовых (возможно, пересохранённых в Excel) — везде;
+    прежний путь через COM доступен как engine="com"
 Скрипт располагается в папке scripts внутри корня проекта.
 """
+import math
 import sys
-import shutil
-from pathlib import Path
 import pandas as pd
-import win32com.client as win32
 
-def fill_situacija_reports_com():
-    # Определяем корень проекта из расположения скрипта
-    scripts_dir = Path(__file__).resolve().parent
-    root = scripts_dir.parent
+from build_manifest import BuildManifest, row_version
+from pipeline_context import resolve_context
+from run_metrics import file_timer
+from running_ledger import RunningLedger
+from situacija_totals import MANUAL_TAGS, NUMERIC_TAGS, TAG_COLUMNS, ledger_totals, parse_rate, rate_cells
+from xlsx_cells import read_cells
+from xlsx_tags import contains_tags, replace_tags, replace_tags_in_bytes
+
+
+def build_replacements(row, tag_map, numeric_tags, manual_tags=()):
+    """
+    Значения для замены тегов строки журнала (числа — с десятичной запятой).
+    Теги из manual_tags без значения не заменяются: их заполняют вручную.
+    """
+    replacements = {}
+    for tag, col in tag_map.items():
+        val = row.get(col)
+        if pd.isna(val) and tag in manual_tags:
+            continue
+        if pd.isna(val):
+            repl_str = ""
+        else:
+            repl_str = (
+                str(val).replace(".", ",")
+                if tag in numeric_tags
+                else str(val)
+            )
+        replacements[tag] = repl_str
+    return replacements
+
+
+def manual_rates(report_fp, template_map, replacements) -> dict:
+    """
+    Курсы, введённые вручную в готовый отчёт (те же ячейки, что читает
+    1_journal_update), для тегов курсов, которых нет в журнале: отчёт,
+    собираемый заново из шаблона, их не теряет (в режиме --watch
+    1_journal_update между пересборками не запускается).
+    """
+    cells = {tag: ref for tag, ref in rate_cells(template_map).items() if tag not in replacements}
+    if not cells:
+        return {}
+    values = read_cells(report_fp, list(cells.values()))
+    rates = {}
+    for tag, ref in cells.items():
+        rate = parse_rate(values.get(ref))
+        if not math.isnan(rate):
+            rates[tag] = str(rate).replace(".", ",")
+    return rates
+
+
+def fill_situacija_reports_com(ctx=None, engine: str = "native"):
+    # Корень проекта берётся из контекста; без него — из расположения скрипта
+    ctx, _ = resolve_context(ctx, __file__)
+    root = ctx.root
 
     templates_dir = root / "templates"
     out_sit = root / "Output" / "Situacija"
-    journal_fp = templates_dir / "journal.xlsx"
     template_fp = templates_dir / "situacija_template.xlsx"
 
     # Проверяем доступность шаблонов и папок
-    if not journal_fp.exists():
-        print(f"❌ Файл журнала не найден: {journal_fp}", file=sys.stderr)
-        sys.exit(1)
     if not template_fp.exists():
         print(f"❌ Шаблон situacija не найден: {template_fp}", file=sys.stderr)
         sys.exit(1)
 
     out_sit.mkdir(parents=True, exist_ok=True)
 
-    # Читаем журнал и готовим данные
-    df = pd.read_excel(journal_fp)
-    df["CertDate_dt"] = pd.to_datetime(
-        df["Certificate Date"], dayfirst=True, format="%d.%m.%Y"
+    # Читаем журнал; суммы до строки и с ней — из книги нарастающих итогов,
+    # которая сверяется с журналом и называет затронутые изменением счета
+    df = ctx.journal.copy()
+    ledger = RunningLedger.load(root)
+    invalidated = ledger.sync(ctx.journal_records())
+    df["previous_total"], df["all_total_on_date"], df["previous_total_din"] = ledger_totals(
+        ledger, df.to_dict("records")
     )
-    df = df.sort_values("CertDate_dt").reset_index(drop=True)
-
-    # Предыдущие и кумулятивные суммы
-    df["previous_total"] = df["Total Amount"].cumsum().shift(1).fillna(0)
-    df["all_total_on_date"] = df["Total Amount"].cumsum()
-    df["Total Amount Din"] = pd.to_numeric(
-        df["Total Amount Din"], errors="coerce"
-    ).fillna(0)
-    df["previous_total_din"] = df["Total Amount Din"].cumsum().shift(1).fillna(0)
-
-    # Маппинг тегов на колонки и набор числовых тегов
-    tag_map = {
-        "[date]":              "Certificate Date",
-        "[number]":            "Certificate Number",
-        "[current_total]":     "Total Amount",
-        "[previous_total]":    "previous_total",
-        "[all_total_on date]": "all_total_on_date",
-        "[total_amount_din]":  "previous_total_din",
-    }
-    numeric_tags = {
-        "[current_total]",
-        "[previous_total]",
-        "[all_total_on date]",
-        "[total_amount_din]",
-    }
+
+    # Маппинг тегов на колонки и набор числовых тегов (общие с situacija_totals)
+    tag_map = TAG_COLUMNS
+    numeric_tags = NUMERIC_TAGS
+    manual_tags = MANUAL_TAGS
+
+    # Где в шаблоне стоят теги — из кэша карт шаблонов
+    template_map = ctx.template_map(template_fp, tag_map)
+
+    # Отбираем отчёты, входы которых изменились с прошлого запуска
+    manifest = BuildManifest(root)
+    template_hash = manifest.fingerprint(template_fp)
+    jobs = []
+    for _, row in df.iterrows():
+        dest_fp = out_sit / row.get("Invoice")
+        replacements = build_replacements(row, tag_map, numeric_tags, manual_tags)
+        inputs = {"template": template_hash, "row": row_version(replacements)}
+        # Теги готового отчёта уже заменены: при изменении предыдущих сумм
+        # он собирается заново из шаблона
+        regenerate = row.get("Invoice") in invalidated and dest_fp.exists()
+        if regenerate:
+            replacements.update(manual_rates(dest_fp, template_map, replacements))
+        if regenerate or not manifest.up_to_date(dest_fp, inputs):
+            jobs.append((dest_fp, replacements, inputs, regenerate))
+    print(f"Situacija reports: {len(jobs)} to update, {len(df) - len(jobs)} up to date")
+    if invalidated:
+        print(f"↻ Earlier certificates changed: {len(invalidated)} reports to regenerate")
+
+    unfinished = set()
+    if engine == "com":
+        _fill_with_com(ctx, jobs, template_fp, template_map)
+    else:
+        clone = ctx.template_clone(template_fp)
+        for dest_fp, replacements, _, regenerate in jobs:
+            if dest_fp.exists() and not regenerate:
+                # Готовый отчёт мог быть пересохранён в Excel: карта шаблона
+                # (номера общих строк) к нему не применяется
+                with file_timer("save", dest_fp):
+                    count = replace_tags(dest_fp, replacements)
+                if not count and contains_tags(dest_fp, replacements):
+                    # Теги остались незаменёнными — отчёт не считается
+                    # актуальным и обрабатывается на следующем запуске
+                    print(f"⚠ Tags not replaced in {dest_fp.name}; will retry on next run")
+                    unfinished.add(dest_fp)
+                continue
+            # Новый отчёт — клон шаблона в памяти, сразу в итоговый файл
+            parts = clone.clone()
+            replace_tags_in_bytes(parts, replacements, template_map)
+            with file_timer("write", dest_fp):
+                clone.write(dest_fp, parts)
+
+    for dest_fp, _, inputs, _ in jobs:
+        if dest_fp not in unfinished:
+            manifest.record(dest_fp, inputs)
+    manifest.save()
+    ledger.save()
+
+    print(f"✅ All situacija reports updated in {out_sit}")
+
+
+def _fill_with_com(ctx, jobs, template_fp, template_map):
+    """Замена тегов через Excel COM (только Windows с установленным Excel)."""
+    import time
+    import win32com.client as win32
+    from run_metrics import record_file
 
     # Инициализируем COM Excel
     excel = win32.Dispatch("Excel.Application")
     excel.Visible = False
     excel.DisplayAlerts = False
 
-    for _, row in df.iterrows():
-        invoice_name = row.get("Invoice")
-        dest_fp = out_sit / invoice_name
-
-        # Копируем шаблон, если отчёт ещё не создан
-        if not dest_fp.exists():
-            shutil.copy(template_fp, dest_fp)
+    for dest_fp, replacements, _, regenerate in jobs:
+        # Копируем шаблон, если отчёт ещё не создан или собирается заново
+        if regenerate or not dest_fp.exists():
+            ctx.copy_template(template_fp, dest_fp)
 
+        t_open = time.perf_counter()
         wb = excel.Workbooks.Open(str(dest_fp))
         wb.Worksheets.Select()
 
-        # Заменяем теги в выделении
-        for tag, col in tag_map.items():
-            val = row.get(col)
-            if pd.isna(val):
-                repl_str = ""
-            else:
-                repl_str = (
-                    str(val).replace(".", ",")
-                    if tag in numeric_tags
-                    else str(val)
-                )
+        # Заменяем в выделении только теги, которые есть в шаблоне
+        present = {loc["tag"] for loc in template_map["cells"]}
+        for tag, repl_str in replacements.items():
+            if tag not in present:
+                continue
             excel.Selection.Replace(
                 What=str(tag),
                 Replacement=repl_str,
@@ -101,9 +192,10 @@ def fill_situacija_reports_com():
 
         wb.Save()
         wb.Close(False)
+        record_file("save", dest_fp, time.perf_counter() - t_open)
 
     excel.Quit()
-    print(f"✅ All situacija reports updated in {out_sit}")
+
 
 if __name__ == "__main__":
     fill_situacija_reports_com()
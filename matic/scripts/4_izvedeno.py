@@ -3,11 +3,16 @@
 """
 4_izvedeno.py
 
-1. Читает journal.xlsx из <root>/templates и строит маппинг:
+1. Читает журнал (<root>/templates/journal.sqlite3) и строит маппинг:
    Certificate -> Source File (из столбца A).
 
 2. Для каждого сертификата:
-   - копирует шаблон izvedeno_template.xlsx в <root>/Output/Izvedeno/<Certificate>.xlsx (если ещё нет)
+   - создаёт <root>/Output/Izvedeno/<Certificate>.xlsx (если ещё нет) из шаблона
+     izvedeno_template.xlsx, разобранного один раз на процесс и клонируемого в
+     памяти по частям архива (xlsx_clone): переписываются только XML листов с тегами
+   - берёт из источника только значения столбца 5 для ключей тегов и часы
+     для [extra_hours]: потоковым проходом (в памяти одна строка), результат
+     компактно кэшируется по хэшу содержимого (certificate_cache.key_values)
    - на листах 'K_03_AB radovi', 'K_04_Armiracki' и 'K_00_REKAP' ищет теги:
        * '[data]' на листах radovi и Armiracki
        * '[extra_hours]' на листе K_00_REKAP
@@ -17,144 +22,344 @@
          если уже использовалось — ставим 0
    - сохраняет итоговый файл
 
+3. Сертификаты независимы, поэтому при нескольких сертификатах они обрабатываются
+   в пуле процессов (число процессов — аргумент workers или переменная окружения
+   MATIC_WORKERS, по умолчанию — число ядер). Если в контексте передан общий
+   пул (start.py --projects), сертификаты отправляются в него. Вывод каждого
+   сертификата собирается в процессе-обработчике и печатается в порядке журнала.
+   В одном процессе отчёт сохраняется в потоке записи, пока заполняется
+   следующий, а хэши и значения источников готовятся заранее (io_pipeline).
+
+4. Ячейки с тегами берутся из карты тегов шаблона (template_compiler), которая
+   пересобирается только при изменении шаблона, — листы не просматриваются целиком.
+
+5. Сертификаты, у которых не изменились ни источник, ни шаблон, а файл результата
+   не трогали после записи, пропускаются (build_manifest).
+
+6. Значения позиций всех сертификатов сохраняются в колоночное хранилище
+   (line_items) — для хода позиций по сертификатам без открытия xlsx.
+
 Скрипт лежит в папке "scripts" внутри корня проекта и может запускаться из любой директории.
 """
+import os
 import sys
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from functools import partial
 from pathlib import Path
-import pandas as pd
 from openpyxl import load_workbook
 
-def main():
-    # Определяем корень проекта из расположения скрипта
-    scripts_dir = Path(__file__).resolve().parent
-    root = scripts_dir.parent
+from build_manifest import BuildManifest
+from certificate_cache import scan_key_values
+from line_items import update_store
+from io_pipeline import BackgroundWriter, prefetch
+from pipeline_context import resolve_context
+from run_metrics import add_files, collect_files, current_stage, file_timer
+from template_compiler import cells_by_sheet, compile_template
+from xlsx_clone import TemplateClone
+
+IZVEDENO_TAGS = ('[data]', '[extra_hours]')
+
+
+class _LogCapture:
+    """Поток вывода, который запоминает записи вместе с признаком stderr."""
+
+    def __init__(self, records, is_err):
+        self.records = records
+        self.is_err = is_err
+
+    def write(self, text):
+        self.records.append((self.is_err, text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _process_logged(task, stage=None):
+    """Обработка одного сертификата в процессе пула; возвращает его вывод и замеры файлов."""
+    records = []
+    with redirect_stdout(_LogCapture(records, False)), redirect_stderr(_LogCapture(records, True)), \
+            collect_files(stage) as files:
+        process_certificate(*task)
+    return records, files
+
+
+def _replay(records):
+    for is_err, text in records:
+        (sys.stderr if is_err else sys.stdout).write(text)
+
+
+def resolve_workers(workers=None):
+    if workers is None:
+        workers = int(os.environ.get("MATIC_WORKERS", "0")) or os.cpu_count() or 1
+    return max(1, workers)
+
+
+def main(ctx=None, workers=None):
+    # Корень проекта берётся из контекста; без него — из расположения скрипта
+    ctx, _ = resolve_context(ctx, __file__)
+    root = ctx.root
 
     templates = root / 'templates'
-    journal_fp = templates / 'journal.xlsx'
     template_fp = templates / 'izvedeno_template.xlsx'
     input_dir = root / 'Input'
     output_dir = root / 'Output' / 'Izvedeno'
 
     # Проверки существования необходимых путей
-    for p in (journal_fp, template_fp, input_dir):
+    for p in (template_fp, input_dir):
         if not p.exists():
             print(f"❌ Не найден: {p}", file=sys.stderr)
             sys.exit(1)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Читаем журнал и формируем маппинг Certificate -> Source File
-    df = pd.read_excel(journal_fp, dtype=str)
-    if 'Certificate' not in df.columns:
-        print(f"❌ В '{journal_fp.name}' нет колонки 'Certificate'", file=sys.stderr)
-        sys.exit(1)
+    df = ctx.journal
     source_col = df.columns[0]
     mapping = {
         str(row['Certificate']).strip().removesuffix('.xlsx'): str(row[source_col]).strip().removesuffix('.xlsx')
         for _, row in df.dropna(subset=['Certificate']).iterrows()
     }
 
+    # Отбираем сертификаты, входы которых изменились
+    manifest = BuildManifest(root)
+    template_hash = manifest.fingerprint(template_fp)
+    template_map = ctx.template_map(template_fp, IZVEDENO_TAGS)
+    data_keys = {loc['key'] for loc in template_map['cells'] if loc['tag'] == '[data]'}
+    jobs = [
+        (output_dir / f"{cert_name}.xlsx", input_dir / f"{src_name}.xlsx")
+        for cert_name, src_name in mapping.items()
+    ]
+
+    def load_source(job):
+        target_fp, source_fp = job
+        inputs = {"template": template_hash, "source": manifest.fingerprint(source_fp)}
+        if manifest.up_to_date(target_fp, inputs):
+            return inputs, None, True
+        # Значения источника по ключам тегов — из компактного кэша
+        # certificate_cache или потоковым проходом по источнику
+        source_values = None
+        if source_fp.exists():
+            source_values = ctx.certificate_values(source_fp, data_keys)
+        return inputs, source_values, False
+
+    # Хэши и значения источников готовятся заранее в потоках (io_pipeline)
+    tasks = []
+    task_inputs = []
+    for (target_fp, source_fp), (inputs, source_values, fresh) in prefetch(jobs, load_source):
+        if fresh:
+            print(f"[UP-TO-DATE] {target_fp.name}")
+            continue
+        tasks.append((
+            template_fp, target_fp, source_fp,
+            ctx.template_bytes(template_fp), template_map, source_values,
+        ))
+        task_inputs.append(inputs)
+
     # Обработка каждого сертификата
-    for cert_name, src_name in mapping.items():
-        target_fp = output_dir / f"{cert_name}.xlsx"
-        source_fp = input_dir / f"{src_name}.xlsx"
-        process_certificate(template_fp, target_fp, source_fp)
+    workers = min(resolve_workers(workers), len(tasks))
+    if ctx.executor is not None and tasks:
+        # Общий пул нескольких проектов
+        for records, files in ctx.executor.map(partial(_process_logged, stage=current_stage()), tasks):
+            _replay(records)
+            add_files(files)
+    elif workers <= 1:
+        # Сохранение отчёта идёт в потоке записи, пока заполняется следующий
+        with BackgroundWriter() as writer:
+            for task in tasks:
+                process_certificate(*task, writer=writer)
+    else:
+        print(f"Processing {len(tasks)} certificates with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map отдаёт результаты в порядке задач — вывод детерминирован
+            for records, files in pool.map(partial(_process_logged, stage=current_stage()), tasks):
+                _replay(records)
+                add_files(files)
+
+    for (_, target_fp, *_), inputs in zip(tasks, task_inputs):
+        manifest.record(target_fp, inputs)
+    manifest.save()
+
+    # Значения позиций по сертификатам — в колоночное хранилище (line_items)
+    update_store(ctx, data_keys)
+
+
+def read_source_values(source_path: Path, keys):
+    """
+    Потоковое чтение источника (openpyxl read_only, строка за строкой) без
+    кэша — для запуска process_certificate без контекста.
+    """
+    with file_timer("open", source_path):
+        return scan_key_values(source_path, keys)
+
 
+class _WorkbookCells:
+    """Ячейки уже существующего отчёта (openpyxl)."""
 
-def process_certificate(template_file: Path, target_file: Path, source_path: Path):
+    def __init__(self, wb):
+        self.wb = wb
+        self.sheetnames = wb.sheetnames
+
+    def get(self, sheet, ref):
+        return self.wb[sheet][ref].value
+
+    def set(self, sheet, ref, text):
+        self.wb[sheet][ref].value = text
+
+    def save(self, path):
+        self.wb.save(path)
+
+
+class _CloneCells:
+    """Ячейки нового отчёта — клона шаблона в памяти (xlsx_clone)."""
+
+    def __init__(self, clone: TemplateClone):
+        self.clone = clone
+        self.sheetnames = clone.sheetnames
+        self.parts = clone.clone()
+        self.values = {}
+
+    def get(self, sheet, ref):
+        if (sheet, ref) in self.values:
+            return self.values[(sheet, ref)]
+        return self.clone.cell_texts.get((sheet, ref))
+
+    def set(self, sheet, ref, text):
+        self.values[(sheet, ref)] = text
+
+    def save(self, path):
+        by_sheet = {}
+        for (sheet, ref), text in self.values.items():
+            by_sheet.setdefault(sheet, {})[ref] = text
+        for sheet, values in by_sheet.items():
+            self.clone.set_cells(self.parts, sheet, values)
+        self.clone.write(path, self.parts)
+
+
+def _save_book(book, target_file: Path):
+    with file_timer("save", target_file):
+        book.save(target_file)
+
+
+# Шаблоны, разобранные в этом процессе: хэш шаблона -> TemplateClone
+_clones = {}
+
+
+def template_clone(template_data: bytes, template_map: dict) -> TemplateClone:
+    """
+    Шаблон для клонирования отчётов; в процессе пула разбирается один раз.
+    Результаты формул удаляются, как при сохранении через openpyxl.
+    """
+    digest = template_map.get('hash')
+    clone = _clones.get(digest) if digest else None
+    if clone is None:
+        clone = TemplateClone(template_data, template_map, drop_cached_values=True)
+        if digest:
+            _clones[digest] = clone
+    return clone
+
+
+def process_certificate(template_file: Path, target_file: Path, source_path: Path,
+                        template_data: bytes = None, template_map: dict = None,
+                        source_values: dict = None, writer=None):
+    """
+    template_data — содержимое шаблона, template_map — карта тегов шаблона,
+    source_values — уже извлечённые значения источника (read_source_values);
+    без них всё читается с диска.
+
+    Новый отчёт собирается из клона шаблона в памяти и пишется сразу в
+    target_file (атомарно); существующий открывается и дополняется openpyxl.
+    writer — io_pipeline.BackgroundWriter: сохранение уходит в его поток.
+    """
     used_values = set()
 
-    # Копируем шаблон, если нужно
-    if not target_file.exists():
-        shutil.copy(template_file, target_file)
-        print(f"[CREATED] {target_file.name}")
-    else:
-        print(f"[EXISTS]  {target_file.name}")
+    created = not target_file.exists()
+    print(f"[CREATED] {target_file.name}" if created else f"[EXISTS]  {target_file.name}")
+
+    if template_map is None:
+        template_map = compile_template(template_file, IZVEDENO_TAGS)
 
-    wb = load_workbook(target_file, data_only=False)
-    wb_src = None
-    if source_path.exists():
-        wb_src = load_workbook(source_path, data_only=True)
+    # Источник читается потоково до открытия целевой книги: в памяти
+    # одновременно не бывает обеих книг
+    if source_values is None:
+        if source_path.exists():
+            keys = {loc['key'] for loc in template_map['cells'] if loc['tag'] == '[data]'}
+            source_values = read_source_values(source_path, keys)
+        else:
+            print(f"⚠ Источник не найден: {source_path}", file=sys.stderr)
+
+    if created:
+        if template_data is None:
+            template_data = template_file.read_bytes()
+        book = _CloneCells(template_clone(template_data, template_map))
     else:
-        print(f"⚠ Источник не найден: {source_path}", file=sys.stderr)
+        with file_timer("open", target_file):
+            book = _WorkbookCells(load_workbook(target_file, data_only=False))
 
     # Шаблонные имена листов
     sheets_data = ['K_03_AB radovi', 'K_04_Armiracki']
+    data_sheets = []
     for sheet_name in sheets_data:
-        if sheet_name not in wb.sheetnames:
+        if sheet_name not in book.sheetnames:
             print(f"⚠ Лист '{sheet_name}' не найден в {target_file.name}", file=sys.stderr)
             continue
-        sheet = wb[sheet_name]
+        # Ячейки и ключи из столбца B — по карте шаблона; в уже заполненном
+        # файле тега в ячейке может не остаться, такие ячейки пропускаем
+        tag_cells = []
+        for loc in cells_by_sheet(template_map, '[data]').get(sheet_name, []):
+            value = book.get(sheet_name, loc['cell'])
+            if isinstance(value, str) and '[data]' in value:
+                tag_cells.append((loc, value))
+        data_sheets.append((sheet_name, tag_cells))
+
+    # Индекс ключ -> значение, построенный за один проход по источнику
+    key_index = source_values['keys'] if source_values is not None else {}
+
+    for sheet_name, tag_cells in data_sheets:
         print(f"→ Обработка листа '{sheet_name}'")
 
-        for row in sheet.iter_rows():
-            for cell in row:
-                if isinstance(cell.value, str) and '[data]' in cell.value:
-                    key = sheet.cell(row=cell.row, column=2).value
-                    found = None
-                    if wb_src:
-                        for sht in wb_src.worksheets:
-                            for r in sht.iter_rows():
-                                for c in r:
-                                    if key and c.value and key in str(c.value):
-                                        found = sht.cell(row=c.row, column=5).value
-                                        break
-                                if found is not None:
-                                    break
-                            if found is not None:
-                                break
-
-                    # Уникальность замены
-                    raw_str = str(found) if found is not None else None
-                    if raw_str in used_values:
-                        found = None
-                    else:
-                        used_values.add(raw_str)
-
-                    replacement = '0' if found is None else str(found).replace('.', ',')
-                    original = cell.value
-                    if original.strip() == '[data]':
-                        sheet.cell(row=cell.row, column=cell.column).value = replacement
-                    else:
-                        sheet.cell(row=cell.row, column=cell.column).value = original.replace('[data]', replacement)
-                    print(f"    Row {cell.row}: key='{key}' → '{replacement}'")
+        for loc, original in tag_cells:
+            key = loc['key']
+            found = key_index.get(key) if isinstance(key, str) else None
+
+            # Уникальность замены
+            raw_str = str(found) if found is not None else None
+            if raw_str in used_values:
+                found = None
+            else:
+                used_values.add(raw_str)
+
+            replacement = '0' if found is None else str(found).replace('.', ',')
+            if original.strip() == '[data]':
+                book.set(sheet_name, loc['cell'], replacement)
+            else:
+                book.set(sheet_name, loc['cell'], original.replace('[data]', replacement))
+            print(f"    Row {loc['row']}: key='{key}' → '{replacement}'")
 
     # Обработка K_00_REKAP для [extra_hours]
     rekap = 'K_00_REKAP'
-    if rekap in wb.sheetnames:
-        sheet = wb[rekap]
+    if rekap in book.sheetnames:
         print(f"→ Обработка листа '{rekap}'")
-        target_cell = None
-        for row in sheet.iter_rows():
-            for cell in row:
-                if cell.value == '[extra_hours]':
-                    target_cell = cell
-                    break
-            if target_cell:
+        target_ref = None
+        for loc in cells_by_sheet(template_map, '[extra_hours]').get(rekap, []):
+            if book.get(rekap, loc['cell']) == '[extra_hours]':
+                target_ref = loc['cell']
                 break
-        if target_cell and wb_src:
-            found_extra = None
-            search_text = 'Izvođenje radova po zahtevu Naručioca'
-            for sht in wb_src.worksheets:
-                for r in sht.iter_rows():
-                    for c in r:
-                        if c.value == search_text:
-                            found_extra = sht.cell(row=c.row, column=5).value
-                            break
-                    if found_extra is not None:
-                        break
-                if found_extra is not None:
-                    break
+        if target_ref and source_values is not None:
+            found_extra = source_values['extra_hours']
             replacement = '0' if found_extra is None else str(found_extra).replace('.', ',')
-            sheet.cell(row=target_cell.row, column=target_cell.column).value = replacement
+            book.set(rekap, target_ref, replacement)
             print(f"    [extra_hours] → '{replacement}'")
         else:
             print(f"⚠ Тег '[extra_hours]' не найден или источник отсутствует", file=sys.stderr)
     else:
         print(f"⚠ Лист '{rekap}' не найден в {target_file.name}", file=sys.stderr)
 
-    # Сохраняем файл
-    wb.save(target_file)
+    # Сохраняем файл (в потоке записи, если он передан)
+    if writer is not None:
+        writer.submit(_save_book, book, target_file)
+    else:
+        _save_book(book, target_file)
     print(f"[SAVED]   {target_file.name}\n")
 
 if __name__ == '__main__':
@@ -5,18 +5,52 @@ create_kumulativni_izveštaj.py
 
 Скрипт создаёт кумулятивный отчёт на основе файлов из <root>/Output/Izvedeno:
 1. Находит корень проекта (родитель папки scripts).
-2. Копирует шаблон izvedeno_template.xlsx в <root>/Output/Izvedeno и повторно сохраняет кумулятивный отчёт с датой.
-3. Суммирует ячейки листов 'K_00_REKAP', 'K_03_AB radovi', 'K_04_Armiracki' из всех файлов (кроме текущего отчёта).
-4. Записывает итоговые суммы в новый отчёт и переносит его в папку kumulativni izveštaj.
+2. Разбирает шаблон izvedeno_template.xlsx из памяти (общий контекст) для клонирования
+   (xlsx_clone) — без копии на диске и без openpyxl.
+3. Суммирует ячейки листов 'K_00_REKAP', 'K_03_AB radovi', 'K_04_Armiracki' из всех файлов (кроме текущего отчёта),
+   читая только нужные адреса напрямую из xlsx (xlsx_cells), без Excel.
+   Итоги каждого файла кэшируются в <root>/.cache (ключ: путь, размер, mtime, хэш),
+   поэтому перечитываются только новые и изменившиеся файлы; они читаются заранее
+   в потоках (io_pipeline), а шаблон тем временем разбирается в фоне.
+4. Записывает итоговые суммы в новый отчёт с датой сразу в папку kumulativni izveštaj
+   (через временный файл и rename).
+   Формулы, у которых в файлах нет сохранённого результата, остаются в отчёте формулами
+   и пересчитываются Excel из просуммированных ячеек.
+5. Исторические отчёты (dates — список дат отсечения или 'all', start.py --kumulativni):
+   итоги на все даты считаются одним проходом префиксных сумм по файлам,
+   упорядоченным по дате из имени, и отчёты на каждую дату пишутся параллельно.
 """
+import re
 import sys
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
-import pythoncom
-import win32com.client as win32
-from openpyxl import load_workbook
+import numpy as np
+
+from exchange_rates import to_day
+from file_cache import cache_dir, file_digest, file_stamp, load_json, save_json
+from io_pipeline import prefetch, resolve_depth
+from pipeline_context import resolve_context
+from run_metrics import file_timer
+from xlsx_cells import read_cells
+from xlsx_clone import TemplateClone
+
+TOTALS_CACHE = "izvedeno_totals.json"
+REPORT_PREFIX = "kumulativni izveštaj_"
+DATE_IN_NAME_RE = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+
+# Суммируемые ячейки по листам
+SHEET_CELLS = {
+    "K_00_REKAP": ["F5","F6","F7","F8","F9","F11","F12","F13","D17","F17","F18","F20"],
+    "K_03_AB radovi": [
+        "D13","D14","D15","D22","D30","D31","D32","D40","D41","D42",
+        "D43","D50","D58","D66","D67","D68","D76","D83","D90","D98",
+        "D106","D107","D108","D116","D117","D118","D125","D132","D139",
+        "D147","D148","D154","D161","D169","D170"
+    ],
+    "K_04_Armiracki": ["D13","D20","D27"],
+}
 
 
 def to_number(raw):
@@ -43,10 +77,153 @@ def to_number(raw):
     return 0.0
 
 
-def create_kumulativni_izveštaj():
-    # Определяем корень проекта
-    scripts_dir = Path(__file__).resolve().parent
-    root = scripts_dir.parent
+def read_file_totals(fn: Path, addresses):
+    """
+    Значения ячеек одного файла izvedeno в порядке addresses.
+    None — формула без сохранённого результата или отсутствующий лист.
+    """
+    with file_timer("read", fn):
+        values = read_cells(fn, addresses, formulas=True)
+    vector = []
+    missing = []
+    for sheet, cell in addresses:
+        if (sheet, cell) not in values:
+            if sheet not in missing:
+                missing.append(sheet)
+            vector.append(None)
+            continue
+        raw = values[(sheet, cell)]
+        if isinstance(raw, str) and raw.startswith("="):
+            vector.append(None)
+        else:
+            vector.append(to_number(raw))
+    return vector, missing
+
+
+def load_totals_cache(cache_fp: Path, addresses):
+    """Кэш итогов по файлам; сбрасывается, если поменялся набор адресов."""
+    cache = load_json(cache_fp, None)
+    key = [list(a) for a in addresses]
+    if not cache or cache.get("addresses") != key:
+        cache = {"addresses": key, "files": {}}
+    return cache
+
+
+def cached_file_totals(cache, root: Path, fn: Path, addresses):
+    """
+    Запись кэша для файла. Совпали размер и mtime — берётся без чтения файла;
+    иначе сверяется хэш содержимого, и файл читается только если он изменился.
+    """
+    key = fn.relative_to(root).as_posix()
+    size, mtime = file_stamp(fn)
+    entry = cache["files"].get(key)
+    if entry and entry["size"] == size and entry["mtime"] == mtime:
+        return entry
+
+    digest = file_digest(fn)
+    if not entry or entry["hash"] != digest:
+        vector, missing = read_file_totals(fn, addresses)
+        entry = {"values": vector, "missing": missing, "hash": digest}
+    entry.update(size=size, mtime=mtime)
+    cache["files"][key] = entry
+    return entry
+
+
+def izvedeno_day(fn: Path):
+    """Дата отчёта izvedeno из имени файла (izvedeno_2_11.04.2025.xlsx); нет — NaT."""
+    found = DATE_IN_NAME_RE.findall(fn.stem)
+    return to_day(found[-1]) if found else np.datetime64("NaT", "D")
+
+
+def parse_cutoffs(dates, file_days):
+    """
+    Даты отсечения: даты 'дд.мм.гггг' или 'гггг-мм-дд'; 'all' — все даты
+    отчётов izvedeno. Возвращает отсортированный datetime64[D] без повторов.
+    """
+    if isinstance(dates, str):
+        dates = [dates]
+    explicit = [d for d in dates if d.strip().lower() != "all"]
+    cutoffs = np.array([to_day(d) for d in explicit], dtype="datetime64[D]")
+    bad = [d for d, day in zip(explicit, cutoffs) if np.isnat(day)]
+    if bad:
+        raise ValueError(f"Unrecognised cut-off dates: {', '.join(bad)}")
+    if len(explicit) < len(dates):
+        cutoffs = np.concatenate([cutoffs, file_days[~np.isnat(file_days)]])
+    return np.unique(cutoffs)
+
+
+def cumulative_totals(days, matrix, cutoffs):
+    """
+    Итоги на каждую дату отсечения за один проход: файлы сортируются по дате,
+    по столбцам считаются префиксные суммы, и для даты берётся префикс
+    до неё (searchsorted). Возвращает (суммы, есть значение) — массивы
+    даты × адреса; NaN (формула без результата) не суммируется.
+    """
+    order = np.argsort(days, kind="stable")
+    rows = matrix[order]
+    zeros = np.zeros((1, rows.shape[1]))
+    prefix = np.vstack([zeros, np.nancumsum(rows, axis=0)])
+    counts = np.vstack([zeros, np.cumsum(~np.isnan(rows), axis=0)])
+    idx = np.searchsorted(days[order], cutoffs, side="right")
+    return prefix[idx], counts[idx] > 0
+
+
+def collect_vectors(ctx, output_dir: Path, addresses, exclude=()):
+    """
+    Итоги файлов izvedeno (кроме exclude): (файлы, матрица файлы × адреса).
+    Перечитываются только новые и изменившиеся файлы, следующие — заранее в потоках.
+    """
+    root = ctx.root
+    cache_fp = cache_dir(root) / TOTALS_CACHE
+    cache = load_totals_cache(cache_fp, addresses)
+    files = [fn for fn in sorted(output_dir.glob("*.xlsx")) if fn.name not in exclude]
+    vectors = []
+    for fn, entry in prefetch(files, lambda fn: cached_file_totals(cache, root, fn, addresses)):
+        for sheet in entry["missing"]:
+            print(f"Предупреждение: нет листа {sheet} в {fn.name}", file=sys.stderr)
+        vectors.append(entry["values"])
+
+    # Удаляем из кэша файлы, которых больше нет
+    present = {fn.relative_to(root).as_posix() for fn in output_dir.glob("*.xlsx")}
+    cache["files"] = {k: v for k, v in cache["files"].items() if k in present}
+    save_json(cache_fp, cache)
+
+    # None (формула без результата, нет листа) -> NaN
+    matrix = np.array(vectors, dtype=float).reshape(len(vectors), len(addresses))
+    return files, matrix
+
+
+def write_report(clone: TemplateClone, path: Path, addresses, sums, has_value, formulas=frozenset()) -> Path:
+    """
+    Отчёт из клона шаблона: итоги записываются числами в ячейки, для которых
+    нашлось хотя бы одно значение (а не формула без результата). Ячейка без
+    значений получает 0, как в прежнем отчёте, кроме формул шаблона (formulas):
+    они остаются и пересчитываются Excel. Запись атомарная.
+    """
+    parts = clone.clone()
+    by_sheet = {}
+    for (sheet, cell), total, ok in zip(addresses, sums, has_value):
+        if ok:
+            by_sheet.setdefault(sheet, {})[cell] = float(total)
+        elif (sheet, cell) not in formulas:
+            # Тег шаблона ('[data]', '[extra_hours]') без единого файла
+            by_sheet.setdefault(sheet, {})[cell] = 0.0
+    for sheet, values in by_sheet.items():
+        clone.set_numbers(parts, sheet, values)
+    with file_timer("save", path):
+        clone.write(path, parts)
+    return path
+
+
+def create_kumulativni_izveštaj(ctx=None, dates=None):
+    """
+    dates=None — один отчёт с сегодняшней датой по всем файлам. Список дат
+    отсечения или 'all' (все даты отчётов izvedeno) — по отчёту на каждую
+    дату из файлов не позже неё.
+    """
+    # Корень проекта берётся из контекста; без него — родитель папки scripts
+    ctx, _ = resolve_context(ctx, __file__)
+    root = ctx.root
 
     templates_dir = root / "templates"
     template = templates_dir / "izvedeno_template.xlsx"
@@ -61,75 +238,49 @@ def create_kumulativni_izveštaj():
 
     # Имя итогового файла
     today = datetime.now().strftime("%d.%m.%Y")
-    report_name = f"kumulativni izveštaj_{today}.xlsx"
-    temp_report = output_dir / report_name
+    report_name = f"{REPORT_PREFIX}{today}.xlsx"
+    addresses = [(sheet, cell) for sheet, cells in SHEET_CELLS.items() for cell in cells]
 
-    shutil.copy2(template, temp_report)
+    # Шаблон разбирается в фоне, пока читаются итоги; результаты формул и
+    # calcChain удаляются, как при сохранении через openpyxl
+    def load_template(path):
+        with file_timer("open", path):
+            return TemplateClone(ctx.template_bytes(path), drop_cached_values=True)
 
-    # Словари для суммирования
-    cells_rekap = ["F5","F6","F7","F8","F9","F11","F12","F13","D17","F17","F18","F20"]
-    totals_rekap = dict.fromkeys(cells_rekap, 0.0)
+    template_load = prefetch([template], load_template, depth=1)
+    files, matrix = collect_vectors(ctx, output_dir, addresses, exclude={report_name})
+    _, clone = next(template_load)
+    template_load.close()
+    formulas = clone.formula_cells(addresses)
 
-    cells_ab = [
-        "D13","D14","D15","D22","D30","D31","D32","D40","D41","D42",
-        "D43","D50","D58","D66","D67","D68","D76","D83","D90","D98",
-        "D106","D107","D108","D116","D117","D118","D125","D132","D139",
-        "D147","D148","D154","D161","D169","D170"
-    ]
-    totals_ab = dict.fromkeys(cells_ab, 0.0)
-
-    cells_arm = ["D13","D20","D27"]
-    totals_arm = dict.fromkeys(cells_arm, 0.0)
+    if dates is None:
+        # Векторное суммирование по всем файлам
+        sums = np.nansum(matrix, axis=0)
+        has_value = (~np.isnan(matrix)).any(axis=0)
+        final_path = write_report(clone, kum_dir / report_name, addresses, sums, has_value, formulas)
+        print(f"Кумулятивный отчёт создан: {final_path}")
+        return
 
-    # COM Excel
-    pythoncom.CoInitialize()
-    excel = win32.Dispatch("Excel.Application")
-    excel.Visible = False
-    excel.DisplayAlerts = False
+    # Исторические отчёты: префиксные суммы по датам файлов
+    days = np.array([izvedeno_day(fn) for fn in files], dtype="datetime64[D]")
+    for fn, day in zip(files, days):
+        if np.isnat(day):
+            print(f"Предупреждение: нет даты в имени {fn.name}, файл пропущен", file=sys.stderr)
+    dated = ~np.isnat(days)
+    days, matrix = days[dated], matrix[dated]
+    cutoffs = parse_cutoffs(dates, days)
+    sums, has_value = cumulative_totals(days, matrix, cutoffs)
 
-    # Проходим по всем файлам кроме текущего отчёта и kum_dir
-    for fn in output_dir.glob("*.xlsx"):
-        if fn.name == report_name:
-            continue
-        wb = excel.Workbooks.Open(str(fn), ReadOnly=True)
-        try:
-            ws = wb.Worksheets("K_00_REKAP")
-            for cell in cells_rekap:
-                totals_rekap[cell] += to_number(ws.Range(cell).Value)
-        except Exception:
-            print(f"Предупреждение: нет листа K_00_REKAP в {fn.name}", file=sys.stderr)
-        try:
-            ws = wb.Worksheets("K_03_AB radovi")
-            for cell in cells_ab:
-                totals_ab[cell] += to_number(ws.Range(cell).Value)
-        except Exception:
-            print(f"Предупреждение: нет листа K_03_AB radovi в {fn.name}", file=sys.stderr)
-        try:
-            ws = wb.Worksheets("K_04_Armiracki")
-            for cell in cells_arm:
-                totals_arm[cell] += to_number(ws.Range(cell).Value)
-        except Exception:
-            print(f"Предупреждение: нет листа K_04_Armiracki в {fn.name}", file=sys.stderr)
-        wb.Close(False)
-
-    excel.Quit()
-    pythoncom.CoUninitialize()
-
-    # Запись итогов
-    wb_rep = load_workbook(temp_report)
-    for cell, total in totals_rekap.items():
-        wb_rep["K_00_REKAP"][cell].value = total
-    for cell, total in totals_ab.items():
-        wb_rep["K_03_AB radovi"][cell].value = total
-    for cell, total in totals_arm.items():
-        wb_rep["K_04_Armiracki"][cell].value = total
-    wb_rep.save(temp_report)
-
-    # Перемещение в kum_dir
-    final_path = kum_dir / report_name
-    shutil.move(str(temp_report), str(final_path))
-    print(f"Кумулятивный отчёт создан: {final_path}")
+    paths = [kum_dir / f"{REPORT_PREFIX}{day.item().strftime('%d.%m.%Y')}.xlsx" for day in cutoffs]
+    with ThreadPoolExecutor(max_workers=resolve_depth(), thread_name_prefix="kumulativni") as pool:
+        futures = [
+            pool.submit(write_report, clone, path, addresses, row_sums, row_has, formulas)
+            for path, row_sums, row_has in zip(paths, sums, has_value)
+        ]
+        for future in futures:
+            print(f"Кумулятивный отчёт создан: {future.result()}")
+    print(f"✅ {len(paths)} cumulative reports written to {kum_dir}")
 
 
 if __name__ == "__main__":
-    create_kumulativni_izveštaj()
\ No newline at end of file
+    create_kumulativni_izveštaj()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+build_manifest.py
+
+Манифест сборки (<root>/.cache/build_manifest.json) для инкрементальных запусков.
+
+Для каждого результата (файла отчёта или значения в журнале) хранится набор
+входов, из которых он был получен: хэши сертификата-источника и шаблона,
+версия строки журнала. Этап пропускает результат, если его входы не
+изменились и сам файл результата не трогали после записи.
+
+Хэши входных файлов запоминаются вместе с размером и mtime, поэтому
+неизменный файл повторно не читается.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+from file_cache import cache_dir, file_digest, file_stamp, load_json, save_json
+
+MANIFEST_NAME = "build_manifest.json"
+
+
+def row_version(values: dict) -> str:
+    """Версия строки журнала: хэш значений, от которых зависит результат."""
+    payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class BuildManifest:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.path = cache_dir(self.root) / MANIFEST_NAME
+        data = load_json(self.path, None) or {}
+        self.outputs = data.get("outputs", {})
+        self.hashes = data.get("hashes", {})
+
+    def _key(self, path) -> str:
+        path = Path(path)
+        try:
+            return path.resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return path.resolve().as_posix()
+
+    def fingerprint(self, path):
+        """Хэш содержимого файла (None, если файла нет) с мемоизацией по размеру и mtime."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        key = self._key(path)
+        size, mtime = file_stamp(path)
+        known = self.hashes.get(key)
+        if known and known["size"] == size and known["mtime"] == mtime:
+            return known["hash"]
+        digest = file_digest(path)
+        self.hashes[key] = {"size": size, "mtime": mtime, "hash": digest}
+        return digest
+
+    def up_to_date(self, output, inputs: dict) -> bool:
+        """
+        output — путь к файлу результата или строковый ключ (например,
+        'journal:<Invoice>') для результатов, которые не являются файлами.
+        """
+        key = output if isinstance(output, str) else self._key(output)
+        entry = self.outputs.get(key)
+        if entry is None or entry["inputs"] != inputs:
+            return False
+        if isinstance(output, str):
+            return True
+        return Path(output).exists() and list(file_stamp(output)) == entry["stamp"]
+
+    def record(self, output, inputs: dict):
+        key = output if isinstance(output, str) else self._key(output)
+        entry = {"inputs": inputs}
+        if not isinstance(output, str):
+            entry["stamp"] = list(file_stamp(output))
+        self.outputs[key] = entry
+
+    def save(self):
+        save_json(self.path, {"outputs": self.outputs, "hashes": self.hashes})
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+certificate_cache.py
+
+Разбор сертификатов из Input один раз в компактную нормализованную форму,
+которую читают все этапы (2_journal — суммы, 4_izvedeno — значения для тегов).
+
+Нормализованный сертификат (по столбцам):
+  - sheets — имена листов
+  - names, amounts — столбцы 'Name' и 'Amount in certificate with VAT' листа
+    'Completion certificate' (без строки заголовков; пустые строки — None)
+
+Значения для тегов izvedeno (key_values) кэшируются отдельно и компактно —
+только по ключам шаблона: {'keys': {ключ: значение столбца 5},
+'extra_hours': ...}. Они собираются тем же потоковым проходом, что и лист
+сумм (key_index.build_key_index): файл разбирается один раз, в памяти
+держится одна строка, так что память не растёт с размером листов.
+
+Кэш лежит в <root>/.cache/certificates: <хэш>.json на каждое содержимое,
+<хэш>.<хэш набора ключей>.keys.json — значения тегов, и index.json (путь -> размер, mtime, хэш), так что неизменный файл не читается
+и не хэшируется повторно. Сертификаты с одинаковым содержимым (например,
+переименованная копия) имеют один хэш — это используется для поиска дублей.
+"""
+import hashlib
+from pathlib import Path
+
+from file_cache import cache_dir, file_digest, file_stamp, load_json, save_json
+from key_index import VALUE_COLUMN, build_key_index
+from run_metrics import file_timer
+
+CACHE_SUBDIR = "certificates"
+INDEX_NAME = "index.json"
+# Версия нормализованной формы: при изменении разбора старый кэш не используется
+FORMAT_VERSION = 2
+
+AMOUNT_SHEET = "Completion certificate"
+NAME_COLUMN = "Name"
+AMOUNT_COLUMN = "Amount in certificate with VAT"
+EXTRA_HOURS_TEXT = "Izvođenje radova po zahtevu Naručioca"
+
+
+def _blank_to_none(value):
+    # Пустые строки — пропуски, как у pd.read_excel
+    return None if value == "" else value
+
+
+def _json_value(value):
+    """Значение ячейки в виде, который переживает JSON (даты — строкой, как str())."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _scan(path: Path, keys=None, amounts: bool = True) -> dict:
+    """
+    Один потоковый проход по сертификату (openpyxl read_only, строка за
+    строкой): при amounts — столбцы листа сумм, при keys — значения тегов
+    izvedeno ({'keys': {ключ: значение столбца 5}, 'extra_hours': ...}).
+    Память не зависит от размера листов: в ней держится одна строка.
+    """
+    from openpyxl import load_workbook
+
+    cert = {
+        "version": FORMAT_VERSION,
+        "sheets": [],
+        "names": None,
+        "amounts": None,
+    }
+    extra = []
+
+    def amount_rows(ws):
+        name_idx = amount_idx = None
+        for row_num, row in enumerate(ws.iter_rows(values_only=True)):
+            yield row
+            if row_num == 0:
+                header = list(row)
+                name_idx = header.index(NAME_COLUMN) if NAME_COLUMN in header else None
+                amount_idx = header.index(AMOUNT_COLUMN) if AMOUNT_COLUMN in header else None
+                cert["names"] = [] if name_idx is not None else None
+                cert["amounts"] = [] if amount_idx is not None else None
+                continue
+            if name_idx is not None:
+                cell = row[name_idx] if len(row) > name_idx else None
+                cert["names"].append(_json_value(_blank_to_none(cell)))
+            if amount_idx is not None:
+                cell = row[amount_idx] if len(row) > amount_idx else None
+                cert["amounts"].append(_json_value(_blank_to_none(cell)))
+
+    def rows_of(ws):
+        rows = amount_rows(ws) if amounts and ws.title == AMOUNT_SHEET else ws.iter_rows(values_only=True)
+        for row in rows:
+            if (keys is not None and not extra and EXTRA_HOURS_TEXT in row
+                    and len(row) >= VALUE_COLUMN and row[VALUE_COLUMN - 1] is not None):
+                extra.append(row[VALUE_COLUMN - 1])
+            yield row
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        cert["sheets"] = list(wb.sheetnames)
+        sheets = []
+        for ws in wb.worksheets:
+            # Размер листа в файле бывает записан неверно — читаем все строки
+            ws.reset_dimensions()
+            sheets.append((ws.title, rows_of(ws)))
+        key_index = build_key_index([rows for _, rows in sheets], keys) if keys is not None else {}
+        # Ключи нашлись раньше конца листа сумм или строки с часами — дочитываем
+        # по порядку листов: лист сумм целиком, остальные — до строки с часами
+        for title, rows in sheets:
+            whole = amounts and title == AMOUNT_SHEET
+            if not whole and (keys is None or extra):
+                continue
+            for _ in rows:
+                if extra and not whole:
+                    break
+    finally:
+        wb.close()
+    if keys is not None:
+        cert["key_values"] = {
+            "keys": {key: _json_value(value) for key, value in key_index.items()},
+            "extra_hours": _json_value(extra[0]) if extra else None,
+        }
+    return cert
+
+
+def parse_certificate(path: Path, keys=None) -> dict:
+    """
+    Нормализованная форма сертификата; при keys (ключи тегов '[data]'
+    шаблона izvedeno) тем же проходом собираются и значения тегов —
+    в cert['key_values'].
+    """
+    return _scan(path, keys)
+
+
+def scan_key_values(path: Path, keys) -> dict:
+    """Только значения тегов izvedeno (без листа сумм) — для запуска без кэша."""
+    return _scan(path, keys, amounts=False)["key_values"]
+
+
+def _keys_digest(keys) -> str:
+    text = "\x00".join(sorted(k for k in keys if isinstance(k, str) and k))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class CertificateCache:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.dir = cache_dir(self.root) / CACHE_SUBDIR
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / INDEX_NAME
+        self.index = load_json(self.index_path, None) or {}
+        self._dirty = False
+
+    def _key(self, path: Path) -> str:
+        try:
+            return path.resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return path.resolve().as_posix()
+
+    def content_hash(self, path: Path) -> str:
+        """Хэш содержимого; по совпадению размера и mtime — без чтения файла."""
+        path = Path(path)
+        key = self._key(path)
+        size, mtime = file_stamp(path)
+        entry = self.index.get(key)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            return entry["hash"]
+        digest = file_digest(path)
+        self.index[key] = {"size": size, "mtime": mtime, "hash": digest}
+        self._dirty = True
+        return digest
+
+    def _values_path(self, digest: str, keys) -> Path:
+        return self.dir / f"{digest}.{_keys_digest(keys)}.keys.json"
+
+    def _parse(self, path: Path, digest: str, keys) -> tuple:
+        """Разбор источника одним проходом; сертификат и значения тегов сохраняются."""
+        with file_timer("parse", path):
+            cert = parse_certificate(path, keys)
+        values = cert.pop("key_values", None)
+        cert["hash"] = digest
+        save_json(self.dir / f"{digest}.json", cert)
+        if values is not None:
+            save_json(self._values_path(digest, keys), values)
+        return cert, values
+
+    def get(self, path: Path, keys=None) -> dict:
+        """
+        Нормализованный сертификат (из кэша или разобранный и сохранённый).
+        keys — ключи тегов izvedeno: если их значений ещё нет в кэше, они
+        собираются тем же проходом по файлу.
+        """
+        path = Path(path)
+        digest = self.content_hash(path)
+        cert = load_json(self.dir / f"{digest}.json", None)
+        stale = cert is None or cert.get("version") != FORMAT_VERSION
+        if stale or (keys is not None and not self._values_path(digest, keys).exists()):
+            cert, _ = self._parse(path, digest, keys)
+        return cert
+
+    def key_values(self, path: Path, keys) -> dict:
+        """
+        Значения тегов izvedeno по ключам keys. Кэш компактный (по хэшу
+        содержимого и набору ключей), его пишет разбор сертификата; без него
+        сертификат разбирается — тоже один раз для обоих видов данных.
+        """
+        path = Path(path)
+        digest = self.content_hash(path)
+        values = load_json(self._values_path(digest, keys), None)
+        if values is None:
+            _, values = self._parse(path, digest, keys)
+        return values
+
+    def duplicates_of(self, path: Path, candidates) -> list:
+        """Имена файлов из candidates с тем же содержимым, что и path."""
+        digest = self.content_hash(path)
+        return [
+            Path(c).name for c in candidates
+            if Path(c).exists() and Path(c) != Path(path) and self.content_hash(c) == digest
+        ]
+
+    def save(self):
+        if self._dirty:
+            save_json(self.index_path, self.index)
+            self._dirty = False
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+exchange_rates.py
+
+Локальная таблица курса евро (средний курс НБС) для расчёта сумм в динарах
+без ручного ввода курса в каждую situacija.
+
+  - таблица хранится в <root>/templates/exchange_rates.csv (date,rate;
+    даты ISO, по возрастанию) и пополняется импортом из CSV (import_rates,
+    start.py --import-rates FILE): строки с теми же датами заменяются
+  - импортируемый CSV: столбцы с датой и курсом (по заголовку 'date'/'datum'
+    и 'rate'/'kurs', иначе — первые два), разделитель ',' или ';', даты
+    'дд.мм.гггг' или 'гггг-мм-дд', десятичная запятая допускается
+  - курс на дату берётся "на дату или ранее" (as-of): на выходные и
+    праздники действует курс последнего рабочего дня
+  - поиск векторный (numpy.searchsorted по отсортированным датам), так
+    что курсы и суммы в динарах считаются для всего журнала за один проход
+
+Для строки журнала нужны два курса: на дату сертификата (H39 шаблона
+situacija) и на дату авансного счёта (B34); дата авансного счёта берётся из
+строки аванса шаблона ('... od 14.02.2025.'). Сумма в динарах считается по
+формулам шаблона (situacija_totals).
+"""
+import csv
+import os
+import re
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+
+RATES_NAME = "exchange_rates.csv"
+# Строка аванса в шаблоне situacija: 'Odbija se avans po avansnom računu br. ... od 14.02.2025.'
+ADVANCE_CELL = "A33"
+
+_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+_ISO_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+def to_day(value):
+    """Дата в numpy.datetime64[D]; нераспознанное значение — NaT."""
+    if isinstance(value, (datetime, date)):
+        return np.datetime64(value.strftime("%Y-%m-%d"), "D")
+    if isinstance(value, str):
+        text = value.strip()
+        # Несуществующая дата (31.02.2025, 2025-02-30) — тоже NaT
+        m = _ISO_RE.match(text)
+        if m:
+            try:
+                return np.datetime64(f"{m.group(1)}-{m.group(2)}-{m.group(3)}", "D")
+            except ValueError:
+                return np.datetime64("NaT", "D")
+        m = _DATE_RE.match(text)
+        if m:
+            day, month, year = m.groups()
+            try:
+                return np.datetime64(f"{year}-{int(month):02d}-{int(day):02d}", "D")
+            except ValueError:
+                return np.datetime64("NaT", "D")
+    return np.datetime64("NaT", "D")
+
+
+def _to_rate(text: str) -> float:
+    text = text.strip().replace(" ", "").replace(" ", "")
+    if "," in text and "." not in text:
+        text = text.replace(",", ".")
+    return float(text.replace(",", ""))
+
+
+class RateTable:
+    """Курсы по датам: dates — datetime64[D] по возрастанию, rates — float."""
+
+    def __init__(self, dates=(), rates=()):
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        rates = np.asarray(rates, dtype=float)
+        order = np.argsort(dates, kind="stable")
+        self.dates = dates[order]
+        self.rates = rates[order]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def rates_on(self, days) -> np.ndarray:
+        """Курсы на даты (as-of); до первой даты таблицы и для NaT — NaN."""
+        days = np.asarray(days, dtype="datetime64[D]")
+        result = np.full(days.shape, np.nan)
+        if not len(self.dates):
+            return result
+        idx = np.searchsorted(self.dates, days, side="right") - 1
+        ok = (idx >= 0) & ~np.isnat(days)
+        result[ok] = self.rates[idx[ok]]
+        return result
+
+    def rate_on(self, day):
+        rate = self.rates_on([to_day(day)])[0]
+        return None if np.isnan(rate) else float(rate)
+
+
+def rates_path(root: Path) -> Path:
+    return Path(root) / "templates" / RATES_NAME
+
+
+def read_rates_csv(path: Path) -> dict:
+    """{datetime64[D]: курс} из CSV в любом из поддерживаемых видов."""
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        text = fh.read()
+    delimiter = ";" if text.count(";") > text.count(",") else ","
+    rows = [r for r in csv.reader(text.splitlines(), delimiter=delimiter) if any(c.strip() for c in r)]
+    if not rows:
+        return {}
+
+    date_col, rate_col = 0, 1
+    header = [c.strip().lower() for c in rows[0]]
+    if np.isnat(to_day(rows[0][0] if rows[0] else "")):
+        for i, name in enumerate(header):
+            if name in ("date", "datum"):
+                date_col = i
+            elif name in ("rate", "kurs", "srednji kurs"):
+                rate_col = i
+        rows = rows[1:]
+
+    table = {}
+    for line_no, row in enumerate(rows, start=2):
+        day = to_day(row[date_col]) if len(row) > date_col else to_day(None)
+        if np.isnat(day):
+            raise ValueError(f"{path.name}: unrecognised date in row {line_no}: {row}")
+        try:
+            table[day] = _to_rate(row[rate_col])
+        except (IndexError, ValueError):
+            raise ValueError(f"{path.name}: unrecognised rate in row {line_no}: {row}") from None
+    return table
+
+
+def load_rates(root: Path) -> RateTable:
+    """Таблица курсов проекта; без файла — пустая."""
+    path = rates_path(root)
+    if not path.exists():
+        return RateTable()
+    table = read_rates_csv(path)
+    return RateTable(list(table), list(table.values()))
+
+
+def import_rates(root: Path, source: Path) -> int:
+    """Добавляет курсы из CSV в таблицу проекта; возвращает число импортированных строк."""
+    path = rates_path(root)
+    table = read_rates_csv(path) if path.exists() else {}
+    imported = read_rates_csv(Path(source))
+    table.update(imported)
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["date", "rate"])
+        for day in sorted(table):
+            writer.writerow([str(day), repr(table[day])])
+    os.replace(tmp, path)
+    return len(imported)
+
+
+def advance_date(template_fp: Path):
+    """Дата авансного счёта из строки аванса шаблона situacija (NaT, если её нет)."""
+    from xlsx_cells import read_cells
+
+    text = read_cells(template_fp, [(None, ADVANCE_CELL)]).get((None, ADVANCE_CELL))
+    if isinstance(text, str):
+        found = _DATE_RE.findall(text)
+        if found:
+            day, month, year = found[-1]
+            return to_day(f"{day}.{month}.{year}")
+    return np.datetime64("NaT", "D")
+
+
+def rates_for(rates: RateTable, cert_dates, advance_day):
+    """
+    Векторный поиск для строк журнала: (курс на дату аванса, курс на дату
+    сертификата) — массивы; где курса нет — NaN.
+    """
+    days = np.array([to_day(d) for d in cert_dates], dtype="datetime64[D]")
+    bill_rates = rates.rates_on(days)
+    advance_rates = rates.rates_on(np.full(days.shape, advance_day, dtype="datetime64[D]"))
+    return advance_rates, bill_rates
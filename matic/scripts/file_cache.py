@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+file_cache.py
+
+Общие помощники для кэшей в <root>/.cache:
+  - отпечаток файла (размер, mtime) и хэш содержимого
+  - чтение и атомарная запись JSON
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+CACHE_DIR_NAME = ".cache"
+
+
+def cache_dir(root: Path) -> Path:
+    d = Path(root) / CACHE_DIR_NAME
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def file_stamp(path: Path):
+    """Быстрый отпечаток файла без чтения содержимого: (размер, mtime в нс)."""
+    st = Path(path).stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Хэш содержимого файла (BLAKE2b, 128 бит)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_json(path: Path, default=None):
+    """Читает JSON; при отсутствии или повреждении файла возвращает default."""
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path: Path, data):
+    """Записывает JSON атомарно: прерванный запуск не оставит битый файл."""
+    path = Path(path)
+    # Своё имя временного файла у каждого потока: одновременная запись
+    # одного кэша из потоков io_pipeline не мешает друг другу
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, ensure_ascii=False)
+    os.replace(tmp, path)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+formula_eval.py
+
+Вычисление формул листа шаблона без Excel, для подмножества, которое
+используется в situacija_template.xlsx:
+  - числа, ссылки на ячейки того же листа (D27, $D$27), диапазоны в SUM
+  - операторы + - * /, унарные + и -, скобки, функция SUM
+  - общие формулы Excel (t="shared") разворачиваются сдвигом ссылок
+
+Граф зависимостей строится один раз на шаблон (compile_graph /
+load_graph): от нужных ячеек (например, D32) по ссылкам до входных —
+ячеек без формул. Вычисление пакетное: входные значения — массивы
+numpy, по элементу на строку журнала, и каждая формула вычисляется
+один раз для всех строк.
+
+Семантика как у Excel: пустая ячейка — 0, текст, который не читается
+как число, в арифметике даёт ошибку (#VALUE!) — здесь NaN. Формула,
+выходящая за подмножество, даёт FormulaError при построении графа (только
+если она нужна для запрошенных ячеек).
+"""
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from file_cache import file_digest
+from xlsx_cells import NS, _cell_value, shared_strings, sheet_parts
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<number>\d+(?:\.\d*)?(?:[Ee][+-]?\d+)?|\.\d+)"
+    r"|(?P<func>[A-Z][A-Z0-9.]*)\("
+    r"|(?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<ref>\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<op>[-+*/(),])"
+    r")"
+)
+_REF_PARTS_RE = re.compile(r"(\$?)([A-Z]{1,3})(\$?)(\d+)")
+
+# Разобранные в этом процессе графы: (хэш шаблона, лист, ячейки) -> граф
+_graphs = {}
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def _col_index(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def _col_letters(n: int) -> str:
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _plain(ref: str) -> str:
+    return ref.replace("$", "")
+
+
+def _shift_formula(formula: str, origin: str, ref: str) -> str:
+    """Формула общей группы для ячейки ref: относительные ссылки сдвигаются от origin."""
+    o = _REF_PARTS_RE.fullmatch(origin)
+    r = _REF_PARTS_RE.fullmatch(ref)
+    dr = int(r.group(4)) - int(o.group(4))
+    dc = _col_index(r.group(2)) - _col_index(o.group(2))
+
+    def repl(m):
+        col_abs, col, row_abs, row = m.groups()
+        if not col_abs:
+            col = _col_letters(_col_index(col) + dc)
+        if not row_abs:
+            row = str(int(row) + dr)
+        return f"{col_abs}{col}{row_abs}{row}"
+
+    return _REF_PARTS_RE.sub(repl, formula)
+
+
+def read_sheet(path, sheet: str = None):
+    """
+    Ячейки листа (None — активный): (имя листа, {адрес: значение}), для
+    формул — текст '=...' (а не сохранённый результат), для общих строк — их текст.
+    """
+    cells = {}
+    with zipfile.ZipFile(path) as zf:
+        parts, active = sheet_parts(zf)
+        part_of = dict(parts)
+        name = parts[active][0] if sheet is None else sheet
+        if name not in part_of:
+            raise FormulaError(f"Worksheet named '{name}' not found")
+        strings = shared_strings(zf)
+        masters = {}
+        with zf.open(part_of[name]) as fh:
+            for _, elem in ET.iterparse(fh, events=("end",)):
+                if elem.tag == f"{NS}row":
+                    elem.clear()
+                if elem.tag != f"{NS}c":
+                    continue
+                ref = elem.get("r")
+                f = elem.find(f"{NS}f")
+                if f is not None:
+                    text = f.text
+                    if f.get("t") == "shared":
+                        if text:
+                            masters[f.get("si")] = (ref, text)
+                        elif f.get("si") in masters:
+                            origin, master = masters[f.get("si")]
+                            text = _shift_formula(master, origin, ref)
+                    if text is None:
+                        raise FormulaError(f"{name}!{ref}: formula text not found")
+                    cells[ref] = "=" + text
+                else:
+                    kind, value = _cell_value(elem, False)
+                    cells[ref] = strings.get(value) if kind == "s" else value
+                elem.clear()
+    return name, cells
+
+
+class _Parser:
+    """Разбор формулы в выражение Python над словарём значений v."""
+
+    def __init__(self, formula: str, where: str):
+        self.where = where
+        self.tokens = []
+        pos = 0
+        text = formula.rstrip()
+        while pos < len(text):
+            m = _TOKEN_RE.match(text, pos)
+            if m is None or m.end() == pos:
+                raise FormulaError(f"{where}: unsupported formula '={formula}'")
+            kind = m.lastgroup
+            self.tokens.append((kind, m.group(kind)))
+            pos = m.end()
+        self.pos = 0
+        self.refs = set()
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise FormulaError(f"{self.where}: unexpected end of formula or token {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def parse(self) -> str:
+        expr = self.expr()
+        if self.pos != len(self.tokens):
+            raise FormulaError(f"{self.where}: unexpected token {self.peek()[1]!r}")
+        return expr
+
+    def expr(self) -> str:
+        out = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            out = f"({out} {self.take()[1]} {self.term()})"
+        return out
+
+    def term(self) -> str:
+        out = self.unary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            out = f"({out} {self.take()[1]} {self.unary()})"
+        return out
+
+    def unary(self) -> str:
+        if self.peek() in (("op", "+"), ("op", "-")):
+            sign = self.take()[1]
+            return f"({sign}{self.unary()})"
+        return self.primary()
+
+    def _ref(self, ref: str) -> str:
+        ref = _plain(ref)
+        self.refs.add(ref)
+        return f"v[{ref!r}]"
+
+    def _range(self, text: str) -> list:
+        start, end = (_REF_PARTS_RE.fullmatch(_plain(r)) for r in text.split(":"))
+        c1, c2 = sorted((_col_index(start.group(2)), _col_index(end.group(2))))
+        r1, r2 = sorted((int(start.group(4)), int(end.group(4))))
+        return [
+            self._ref(f"{_col_letters(c)}{r}")
+            for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)
+        ]
+
+    def primary(self) -> str:
+        kind, value = self.take()
+        if kind == "number":
+            return repr(float(value))
+        if kind == "ref":
+            return self._ref(value)
+        if kind == "op" and value == "(":
+            inner = self.expr()
+            self.take(")")
+            return inner
+        if kind == "func":
+            if value != "SUM":
+                raise FormulaError(f"{self.where}: unsupported function {value}")
+            args = []
+            while self.peek() != ("op", ")"):
+                if self.peek()[0] == "range":
+                    args.extend(self._range(self.take()[1]))
+                else:
+                    args.append(self.expr())
+                if self.peek() == ("op", ","):
+                    self.take()
+            self.take(")")
+            return f"_sum({', '.join(args)})"
+        raise FormulaError(f"{self.where}: unexpected token {value!r}")
+
+
+def _sum(*values):
+    # SUM, в отличие от +, пропускает текст (NaN); пустые аргументы — 0
+    return sum((np.nan_to_num(np.asarray(v, dtype=float), nan=0.0) for v in values), 0.0)
+
+
+def _constant(value) -> float:
+    """Значение ячейки без формулы в арифметике Excel (текст — число или #VALUE!)."""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return np.nan
+
+
+class FormulaGraph:
+    """Формулы, нужные для целевых ячеек, в порядке вычисления."""
+
+    def __init__(self, cells: dict, targets, sheet: str = "sheet"):
+        self.sheet = sheet
+        self.targets = [_plain(t) for t in targets]
+        self.order = []        # [(адрес, текст выражения)]
+        self.constants = {}    # входные ячейки: адрес -> значение в шаблоне
+        self._code = {}
+        state = {}
+
+        def visit(ref, path):
+            if state.get(ref) == "done":
+                return
+            if state.get(ref) == "visiting":
+                raise FormulaError(f"{sheet}!{ref}: circular reference via {' -> '.join(path)}")
+            value = cells.get(ref)
+            if not (isinstance(value, str) and value.startswith("=")):
+                self.constants[ref] = value
+                state[ref] = "done"
+                return
+            state[ref] = "visiting"
+            parser = _Parser(value[1:], f"{sheet}!{ref}")
+            expr = parser.parse()
+            for dep in sorted(parser.refs):
+                visit(dep, path + [dep])
+            state[ref] = "done"
+            self.order.append((ref, expr))
+
+        for target in self.targets:
+            visit(target, [target])
+        self._code = {ref: compile(expr, f"{sheet}!{ref}", "eval") for ref, expr in self.order}
+
+    @property
+    def inputs(self):
+        """Адреса входных ячеек (без формул), от которых зависят целевые."""
+        return sorted(self.constants)
+
+    def evaluate(self, values: dict, size: int) -> dict:
+        """
+        values — {адрес входной ячейки: массив значений по строкам}; для
+        остальных входов берётся значение из шаблона. Возвращает
+        {адрес: массив} для всех вычисленных и входных ячеек.
+        """
+        env = {}
+        for ref, value in self.constants.items():
+            if ref in values:
+                env[ref] = np.array([_constant(v) for v in values[ref]], dtype=float)
+            else:
+                env[ref] = np.full(size, _constant(value))
+        scope = {"_sum": _sum, "__builtins__": {}}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for ref, _ in self.order:
+                result = eval(self._code[ref], scope, {"v": env})
+                env[ref] = np.broadcast_to(np.asarray(result, dtype=float), (size,)).copy()
+        return env
+
+
+def compile_graph(path, targets, sheet: str = None) -> FormulaGraph:
+    """Граф формул листа шаблона для целевых ячеек (без кэша)."""
+    name, cells = read_sheet(path, sheet)
+    return FormulaGraph(cells, targets, name)
+
+
+def load_graph(path, targets, sheet: str = None) -> FormulaGraph:
+    """Граф формул с запоминанием по хэшу шаблона (один разбор на процесс)."""
+    key = (file_digest(path), sheet, tuple(targets))
+    graph = _graphs.get(key)
+    if graph is None:
+        graph = _graphs[key] = compile_graph(path, targets, sheet)
+    return graph
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+input_watcher.py
+
+Ожидание новых сертификатов в папке Input для режима start.py --watch.
+
+  - если установлен watchdog, изменения в папке приходят уведомлениями
+    файловой системы; без него папка опрашивается раз в poll_interval секунд
+  - файл считается готовым, когда его размер и mtime не менялись debounce
+    секунд и он открывается как zip (xlsx): недописанный файл пропускается
+    до следующей проверки
+  - временные файлы Excel ('~$...') игнорируются
+"""
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from file_cache import file_stamp
+
+
+class InputWatcher:
+    def __init__(self, input_dir: Path, debounce: float = 2.0, poll_interval: float = 1.0):
+        self.input_dir = Path(input_dir)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._observer = self._start_observer()
+
+    @property
+    def mode(self) -> str:
+        return "watchdog" if self._observer is not None else "polling"
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        wakeup = self._wakeup
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), str(self.input_dir), recursive=False)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+
+    def _candidates(self):
+        return [p for p in self.input_dir.glob("*.xlsx") if not p.name.startswith("~$")]
+
+    def poll(self, skip) -> list:
+        """
+        Готовые новые файлы (по одному разу). skip(path) -> True для файлов,
+        которые обрабатывать не нужно (уже в журнале и т. п.).
+        """
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        for path in sorted(self._candidates()):
+            if skip(path):
+                continue
+            seen.add(path)
+            try:
+                stamp = file_stamp(path)
+            except OSError:
+                continue
+            known = self._pending.get(path)
+            if known is None or known[0] != stamp:
+                self._pending[path] = (stamp, now)
+                continue
+            if now - known[1] >= self.debounce and zipfile.is_zipfile(path):
+                ready.append(path)
+                del self._pending[path]
+        # Удалённые до готовности файлы больше не ждём
+        for path in set(self._pending) - seen:
+            del self._pending[path]
+        return ready
+
+    def wait(self, skip) -> list:
+        """Блокирует, пока не появятся готовые новые файлы; возвращает их список."""
+        while True:
+            ready = self.poll(skip)
+            if ready:
+                return ready
+            # С уведомлениями без ожидающих файлов спим дольше: нас разбудит событие
+            timeout = self.poll_interval
+            if self._observer is not None and not self._pending:
+                timeout = max(self.poll_interval, 30.0)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+io_pipeline.py
+
+Перекрытие ввода-вывода с обработкой (на сетевых папках большая часть
+времени — ожидание диска):
+
+  - prefetch(items, load) — пул потоков заранее читает следующие файлы
+    (load(item): чтение, распаковка, хэш), пока текущий обрабатывается.
+    Одновременно загружается не больше depth файлов, так что в памяти
+    держится ограниченное число прочитанных книг; результаты отдаются в
+    порядке items. Загрузка начинается сразу при вызове prefetch.
+  - BackgroundWriter — сохранения выполняются в отдельном потоке из
+    ограниченной очереди; ошибка сохранения поднимается в close().
+
+Глубина по умолчанию — переменная окружения MATIC_PREFETCH (4).
+"""
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DEPTH = 4
+
+
+def resolve_depth(depth=None) -> int:
+    if depth is None:
+        depth = int(os.environ.get("MATIC_PREFETCH", "0")) or DEFAULT_DEPTH
+    return max(1, depth)
+
+
+def prefetch(items, load, depth=None):
+    """
+    Итератор пар (item, load(item)) в порядке items. Исключение из load
+    поднимается при получении соответствующего элемента.
+    """
+    items = iter(items)
+    depth = resolve_depth(depth)
+    pool = ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch")
+    pending = deque()
+
+    def submit_next():
+        for item in items:
+            pending.append((item, pool.submit(load, item)))
+            return
+
+    for _ in range(depth):
+        submit_next()
+
+    def results():
+        try:
+            while pending:
+                item, future = pending.popleft()
+                submit_next()
+                yield item, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    return results()
+
+
+class BackgroundWriter:
+    """Поток сохранений: submit(fn, *args) ставит запись в очередь, close() ждёт все."""
+
+    def __init__(self, depth=None):
+        self._queue = queue.Queue(maxsize=resolve_depth(depth))
+        self._errors = []
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            fn, args = job
+            try:
+                fn(*args)
+            except BaseException as e:
+                self._errors.append(e)
+
+    def submit(self, fn, *args):
+        # Очередь полна — ждём: несохранённых книг в памяти не больше depth
+        self._queue.put((fn, args))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Ошибка в основном потоке важнее ошибок записи
+            try:
+                self.close()
+            except BaseException:
+                pass
+        return False
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+journal_store.py
+
+Журнал обработки в SQLite (<root>/templates/journal.sqlite3) вместо
+перезаписи templates/journal.xlsx целиком на каждом этапе.
+
+  - строки индексированы по "Source File" и "Invoice" (уникальные ключи),
+    поэтому проверка "уже обработан" — один запрос по индексу
+  - добавление и обновление строк идут в транзакциях: прерванный запуск
+    не портит журнал
+  - journal.xlsx выгружается только по запросу (export_journal) как
+    представление журнала; при первом запуске старый journal.xlsx
+    импортируется в базу
+  - pandas импортируется только там, где нужен DataFrame: чтение и запись
+    строк через records()/apply() обходятся без него
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+JOURNAL_COLUMNS = [
+    "Source File",
+    "Certificate Number",
+    "Certificate Date",
+    "Total Amount",
+    "Advance Rate",
+    "Total Rate",
+    "Total Amount Din",
+    "Invoice",
+    "Certificate"
+]
+TEXT_COLUMNS = {"Source File", "Certificate Number", "Certificate Date", "Invoice", "Certificate"}
+
+DB_NAME = "journal.sqlite3"
+XLSX_NAME = "journal.xlsx"
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_missing(value) -> bool:
+    """None и пропуски pandas/numpy (NaN, NaT, NA) без импорта pandas."""
+    if value is None:
+        return True
+    try:
+        return bool(value != value)
+    except TypeError:
+        # pd.NA не приводится к bool
+        return True
+
+
+def _clean(col, value):
+    if _is_missing(value):
+        return None
+    if col in TEXT_COLUMNS:
+        return str(value)
+    return value
+
+
+class JournalStore:
+    def __init__(self, db_path: Path, xlsx_path: Path = None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self._create_schema()
+        if xlsx_path is not None and self.count() == 0:
+            self._import_xlsx(Path(xlsx_path))
+
+    def _create_schema(self):
+        cols = ",\n".join(
+            f"{_q(c)} {'TEXT' if c in TEXT_COLUMNS else 'REAL'}" for c in JOURNAL_COLUMNS
+        )
+        with self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY, {cols})"
+            )
+            self.conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS journal_source ON journal ({_q('Source File')})"
+            )
+            self.conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS journal_invoice ON journal ({_q('Invoice')})"
+            )
+
+    def _import_xlsx(self, xlsx_path: Path):
+        """Разовый перенос существующего journal.xlsx в базу."""
+        if not xlsx_path.exists():
+            return
+        import pandas as pd
+        df = pd.read_excel(xlsx_path)
+        missing = [c for c in JOURNAL_COLUMNS if c not in df.columns]
+        if missing:
+            print(f"⚠ Warning: {xlsx_path.name} is missing columns: {missing}. Not imported.")
+            return
+        if len(df):
+            self.append(df[JOURNAL_COLUMNS].to_dict("records"))
+            print(f"Imported {len(df)} rows from {xlsx_path.name} into {self.db_path.name}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def is_processed(self, source_file: str) -> bool:
+        row = self.conn.execute(
+            f"SELECT 1 FROM journal WHERE {_q('Source File')} = ?", (source_file,)
+        ).fetchone()
+        return row is not None
+
+    def append(self, rows):
+        """Добавляет строки (словари по JOURNAL_COLUMNS) одной транзакцией."""
+        self.apply(appends=rows)
+
+    def update(self, updates, key: str = "Invoice"):
+        """
+        Обновляет строки одной транзакцией.
+        updates — {значение ключа: {колонка: значение}}.
+        """
+        self.apply(updates=updates, key=key)
+
+    def apply(self, appends=(), updates=None, key: str = "Invoice"):
+        """Добавление и обновление строк в одной транзакции."""
+        placeholders = ", ".join("?" for _ in JOURNAL_COLUMNS)
+        insert_sql = f"INSERT INTO journal ({', '.join(_q(c) for c in JOURNAL_COLUMNS)}) VALUES ({placeholders})"
+        with self.conn:
+            if appends:
+                self.conn.executemany(
+                    insert_sql, [[_clean(c, row.get(c)) for c in JOURNAL_COLUMNS] for row in appends]
+                )
+            for key_value, values in (updates or {}).items():
+                cols = [c for c in values if c in JOURNAL_COLUMNS]
+                if not cols:
+                    continue
+                assignments = ", ".join(f"{_q(c)} = ?" for c in cols)
+                self.conn.execute(
+                    f"UPDATE journal SET {assignments} WHERE {_q(key)} = ?",
+                    [_clean(c, values[c]) for c in cols] + [key_value],
+                )
+
+    def records(self) -> list:
+        """Журнал как список словарей в порядке добавления строк (без pandas)."""
+        sql = f"SELECT {', '.join(_q(c) for c in JOURNAL_COLUMNS)} FROM journal ORDER BY id"
+        return [dict(zip(JOURNAL_COLUMNS, row)) for row in self.conn.execute(sql)]
+
+    def to_dataframe(self):
+        """Журнал (DataFrame) в порядке добавления строк, с колонками как в journal.xlsx."""
+        import pandas as pd
+        sql = f"SELECT {', '.join(_q(c) for c in JOURNAL_COLUMNS)} FROM journal ORDER BY id"
+        return pd.read_sql_query(sql, self.conn)
+
+    def export_xlsx(self, xlsx_path: Path):
+        self.to_dataframe().to_excel(xlsx_path, index=False)
+
+
+def open_journal(root: Path) -> JournalStore:
+    templates = Path(root) / "templates"
+    return JournalStore(templates / DB_NAME, templates / XLSX_NAME)
+
+
+def export_journal(root: Path = None):
+    """Выгружает журнал в templates/journal.xlsx."""
+    if root is None:
+        root = Path(__file__).resolve().parent.parent
+    xlsx_path = Path(root) / "templates" / XLSX_NAME
+    with open_journal(root) as store:
+        store.export_xlsx(xlsx_path)
+    print(f"✅ Journal exported to {xlsx_path}")
+
+
+if __name__ == "__main__":
+    export_journal(Path(sys.argv[1]) if len(sys.argv) > 1 else None)
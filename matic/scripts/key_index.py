@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+key_index.py
+
+Однопроходный поиск ключей шаблона izvedeno в сертификате-источнике.
+
+Вместо того чтобы для каждого тега '[data]' заново перебирать все ячейки
+источника (O(теги × ячейки)), по всем ключам из столбца 2 шаблона один раз
+строится автомат Ахо–Корасик, и источник просматривается ровно один раз.
+
+Семантика совпадает с прежним поиском в process_certificate:
+  - ключ ищется как подстрока в str(значение ячейки), пустые ячейки пропускаются
+  - ячейки обходятся по листам, затем по строкам, затем слева направо
+  - для ключа берётся первое совпадение, у строки которого в столбце 5
+    есть значение; иначе поиск продолжается дальше
+"""
+from collections import deque
+
+VALUE_COLUMN = 5
+
+
+class KeyMatcher:
+    """Автомат Ахо–Корасик над набором строковых ключей."""
+
+    def __init__(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+
+        for key in keys:
+            node = 0
+            for ch in key:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            if key not in self.out[node]:
+                self.out[node] = self.out[node] + (key,)
+
+        # Ссылки неудач строим обходом в ширину
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str):
+        """Возвращает множество ключей, встречающихся в text как подстроки."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+def build_key_index(sheets_rows, keys):
+    """
+    Один проход по источнику: возвращает словарь key -> значение столбца 5
+    строки первого совпадения. Ключи без совпадения в словарь не попадают.
+
+    sheets_rows — последовательность листов, каждый лист — итерируемое строк
+    значений (как ws.iter_rows(values_only=True)), начиная со столбца A.
+    """
+    pending = {k for k in keys if isinstance(k, str) and k}
+    index = {}
+    if not pending:
+        return index
+
+    matcher = KeyMatcher(pending)
+    for rows in sheets_rows:
+        for row in rows:
+            value = row[VALUE_COLUMN - 1] if len(row) >= VALUE_COLUMN else None
+            if value is None:
+                # Как и раньше: совпадение без значения не считается найденным
+                continue
+            for v in row:
+                if not v:
+                    continue
+                for key in matcher.find(str(v)):
+                    if key in pending:
+                        index[key] = value
+                        pending.discard(key)
+            if not pending:
+                return index
+    return index
+
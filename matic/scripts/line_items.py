@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+line_items.py
+
+Ход позиций (строк работ) по всем сертификатам без повторного открытия xlsx.
+
+Значение позиции в сертификате — то же, что 4_izvedeno подставляет в тег
+'[data]': ключ из столбца 2 шаблона izvedeno ищется в сертификате так же
+(key_index, компактный кэш значений тегов certificate_cache.key_values,
+общий с 4_izvedeno), берётся значение столбца 5 строки совпадения.
+
+Хранилище колоночное, по позициям: <root>/.cache/line_items.json
+  - certificates — сертификаты журнала по дате (source, hash, date, number)
+  - values — {ключ позиции: [значение в каждом сертификате]}, списки
+    выровнены с certificates; позиция не найдена — None
+Ход позиции — один список, без чтения сертификатов (progress, series).
+
+Обновление инкрементальное (update): для новых и изменившихся сертификатов
+(по хэшу содержимого) столбец вычисляется и вставляется на место по дате,
+пропавшие из журнала удаляются. При смене набора ключей шаблона столбцы
+пересчитываются из кэша сертификатов.
+"""
+from bisect import bisect_right
+from pathlib import Path
+
+import numpy as np
+
+from exchange_rates import to_day
+from file_cache import cache_dir, load_json, save_json
+
+STORE_NAME = "line_items.json"
+FORMAT_VERSION = 1
+TEMPLATE_NAME = "izvedeno_template.xlsx"
+# Те же теги, что в 4_izvedeno: карта шаблона берётся из того же кэша
+IZVEDENO_TAGS = ('[data]', '[extra_hours]')
+
+
+def _number(value) -> float:
+    """Значение позиции как число (десятичная запятая допускается); иначе NaN."""
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    if isinstance(value, str):
+        value = value.strip().replace(" ", "").replace(",", ".")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _sort_key(meta: dict):
+    # Номера одной даты — по числовому порядку ('2' раньше '10')
+    return meta["day"], meta["number"].zfill(8), meta["source"]
+
+
+class LineItemStore:
+    def __init__(self, data: dict = None):
+        data = data if data and data.get("version") == FORMAT_VERSION else {}
+        self.keys = data.get("keys", [])
+        self.certificates = data.get("certificates", [])
+        self.values = data.get("values", {})
+
+    @classmethod
+    def load(cls, root: Path) -> "LineItemStore":
+        return cls(load_json(cache_dir(root) / STORE_NAME, None))
+
+    def save(self, root: Path):
+        save_json(cache_dir(root) / STORE_NAME, {
+            "version": FORMAT_VERSION,
+            "keys": self.keys,
+            "certificates": self.certificates,
+            "values": self.values,
+        })
+
+    # Обновление
+
+    def _insert(self, meta: dict, column: dict):
+        pos = bisect_right([_sort_key(m) for m in self.certificates], _sort_key(meta))
+        self.certificates.insert(pos, meta)
+        for key, series in self.values.items():
+            series.insert(pos, column.get(key))
+
+    def _remove(self, pos: int):
+        del self.certificates[pos]
+        for series in self.values.values():
+            del series[pos]
+
+    def update(self, ctx, keys) -> tuple:
+        """
+        Сверяет хранилище с журналом и сертификатами в Input; keys — ключи
+        '[data]' шаблона izvedeno. Возвращает (добавлено, удалено) столбцов.
+        """
+        keys = sorted(k for k in keys if isinstance(k, str) and k)
+        if keys != self.keys:
+            # Другой набор ключей — все столбцы вычисляются заново
+            self.keys, self.certificates = keys, []
+            self.values = {key: [] for key in keys}
+
+        input_dir = ctx.root / "Input"
+        current = {}
+        for row in ctx.journal_records():
+            source = str(row.get("Source File") or "").strip().removesuffix(".xlsx")
+            path = input_dir / f"{source}.xlsx"
+            if not source or not path.exists():
+                continue
+            day = to_day(row.get("Certificate Date"))
+            current[source] = (path, {
+                "source": source,
+                "hash": ctx.certificate_cache.content_hash(path),
+                "date": row.get("Certificate Date"),
+                "day": "" if np.isnat(day) else str(day),
+                "number": str(row.get("Certificate Number") or ""),
+            })
+
+        removed = 0
+        for pos in reversed(range(len(self.certificates))):
+            meta = self.certificates[pos]
+            if current.get(meta["source"], (None, None))[1] != meta:
+                self._remove(pos)
+                removed += 1
+        known = {meta["source"] for meta in self.certificates}
+
+        added = 0
+        for source, (path, meta) in current.items():
+            if source in known:
+                continue
+            self._insert(meta, ctx.certificate_values(path, keys)["keys"])
+            added += 1
+        return added, removed
+
+    # Запросы
+
+    def find(self, text: str) -> list:
+        """Ключи позиций, содержащие text (без учёта регистра)."""
+        text = text.lower()
+        return [key for key in self.keys if text in key.lower()]
+
+    def progress(self, key: str) -> list:
+        """Ход позиции: [(дата, номер сертификата, значение)] по дате."""
+        return [
+            (meta["date"], meta["number"], value)
+            for meta, value in zip(self.certificates, self.values[key])
+        ]
+
+    def series(self, key: str):
+        """(даты datetime64[D], значения float; не найдено — NaN) для расчётов."""
+        days = np.array([meta["day"] or "NaT" for meta in self.certificates], dtype="datetime64[D]")
+        return days, np.array([_number(v) for v in self.values[key]], dtype=float)
+
+
+def template_keys(ctx) -> set:
+    """Ключи тегов '[data]' шаблона izvedeno (по карте шаблона)."""
+    template_fp = ctx.root / "templates" / TEMPLATE_NAME
+    return {loc['key'] for loc in ctx.template_map(template_fp, IZVEDENO_TAGS)['cells'] if loc['tag'] == '[data]'}
+
+
+def update_store(ctx, keys=None) -> LineItemStore:
+    """Загружает, обновляет и сохраняет хранилище позиций проекта."""
+    store = LineItemStore.load(ctx.root)
+    added, removed = store.update(ctx, template_keys(ctx) if keys is None else keys)
+    if added or removed:
+        store.save(ctx.root)
+        print(f"📈 Line items: {len(store.certificates)} certificates (+{added}, -{removed})")
+    return store
+
+
+def print_progress(ctx, text: str):
+    """Ход позиций, ключ которых содержит text (start.py --item-progress)."""
+    store = update_store(ctx)
+    keys = store.find(text)
+    if not keys:
+        print(f"⚠ No line items match '{text}'")
+        return
+    for key in keys:
+        print(f"\n{key}")
+        for cert_date, number, value in store.progress(key):
+            print(f"  {cert_date or '-':<12} #{number:<4} {'-' if value is None else value}")
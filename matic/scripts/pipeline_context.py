@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline_context.py
+
+Общий контекст конвейера, который start.py передаёт всем скриптам по очереди.
+
+В контексте один раз за запуск загружаются и хранятся в памяти:
+  - журнал (DataFrame); изменения копятся и записываются в journal.sqlite3
+    одной транзакцией в flush() в конце запуска
+  - сертификаты из Input в нормализованной форме (certificate_cache; разбор
+    кэшируется на диске по хэшу содержимого)
+  - таблица курсов евро (exchange_rates) для сумм в динарах
+  - содержимое шаблонов (копии отчётов пишутся из памяти или клонируются по
+    частям архива, xlsx_clone) и карты их тегов (template_compiler)
+Таблица курсов и всё, что получено из шаблонов, привязано к отпечатку файла
+(размер, mtime): в режиме --watch изменённый шаблон или таблица курсов,
+импортированная другим процессом, читается заново.
+
+Скрипт, запущенный отдельно (без контекста), создаёт свой контекст и сам
+вызывает flush() в конце.
+
+pandas и openpyxl импортируются при первом обращении к журналу-DataFrame и к
+сертификатам: этап, которому они не нужны (1_journal_update работает со
+строками журнала через journal_records), не платит за их загрузку.
+"""
+import os
+from pathlib import Path
+
+from certificate_cache import AMOUNT_COLUMN, AMOUNT_SHEET, NAME_COLUMN, CertificateCache
+from file_cache import file_stamp
+from journal_store import JOURNAL_COLUMNS, open_journal
+from run_metrics import file_timer
+from template_compiler import load_template_map
+from xlsx_clone import TemplateClone
+
+
+class PipelineContext:
+    def __init__(self, root: Path, executor=None):
+        self.root = Path(root)
+        # Общий пул процессов (режим нескольких проектов); None — этап создаёт свой
+        self.executor = executor
+        self._journal = None
+        self._processed = None
+        self._appends = []
+        self._updates = {}
+        self._certificate_cache = None
+        self._templates = {}
+        self._clones = {}
+        self._rates = {}
+        self._advance_days = {}
+        self._template_maps = {}
+
+    # Журнал
+
+    @property
+    def journal(self):
+        """Журнал в памяти (DataFrame). Изменять только через append_journal / update_journal."""
+        if self._journal is None:
+            with open_journal(self.root) as store:
+                self._journal = store.to_dataframe()
+            self._processed = set(self._journal["Source File"].astype(str))
+            # Обновления, сделанные до загрузки DataFrame
+            for key_value, values in self._updates.items():
+                self._set_values(key_value, values)
+        return self._journal
+
+    def journal_records(self) -> list:
+        """
+        Строки журнала как словари (пропуски — None). Пока DataFrame не загружен,
+        строки читаются прямо из базы, без pandas.
+        """
+        if self._journal is None:
+            with open_journal(self.root) as store:
+                records = store.records()
+            for row in records:
+                row.update(self._updates.get(row.get("Invoice"), {}))
+            return records
+        return [
+            {k: (None if v is None or v != v else v) for k, v in row.items()}
+            for row in self._journal.to_dict("records")
+        ]
+
+    def _set_values(self, key_value, values: dict, key: str = "Invoice"):
+        df = self._journal
+        mask = df[key] == key_value
+        for col, value in values.items():
+            if df[col].dtype != object:
+                df[col] = df[col].astype(object)
+            df.loc[mask, col] = value
+
+    def is_processed(self, source_file: str) -> bool:
+        """
+        Есть ли файл в журнале. Пока DataFrame не загружен, проверка идёт
+        запросом по индексу journal_source (режим --watch не грузит журнал).
+        """
+        if self._processed is not None:
+            return source_file in self._processed
+        if any(str(r.get("Source File")) == source_file for r in self._appends):
+            return True
+        with open_journal(self.root) as store:
+            return store.is_processed(source_file)
+
+    def append_journal(self, row: dict):
+        df = self.journal
+        df.loc[len(df)] = [row.get(c) for c in JOURNAL_COLUMNS]
+        self._processed.add(str(row.get("Source File")))
+        self._appends.append(dict(row))
+
+    def update_journal(self, updates: dict, key: str = "Invoice"):
+        """
+        updates — {значение ключа: {колонка: значение}}. Если DataFrame журнала
+        ещё не загружен, изменения применятся к нему при загрузке.
+        """
+        for key_value, values in updates.items():
+            if self._journal is not None:
+                self._set_values(key_value, values, key)
+            # Обновление ещё не записанной строки попадает прямо в неё
+            pending = next((r for r in self._appends if r.get(key) == key_value), None)
+            if pending is not None:
+                pending.update(values)
+            else:
+                self._updates.setdefault(key_value, {}).update(values)
+
+    def flush(self):
+        """Записывает накопленные изменения журнала одной транзакцией."""
+        if self._certificate_cache is not None:
+            self._certificate_cache.save()
+        if not self._appends and not self._updates:
+            return
+        with file_timer("journal", self.root / "templates"), open_journal(self.root) as store:
+            store.apply(appends=self._appends, updates=self._updates)
+        self._appends = []
+        self._updates = {}
+
+    # Сертификаты
+
+    def certificate(self, path: Path) -> dict:
+        """
+        Нормализованный сертификат (certificate_cache), разбирается один раз
+        вместе со значениями тегов izvedeno (certificate_keys); в контексте
+        не хранится — при повторном запросе читается из кэша.
+        """
+        return self.certificate_cache.get(Path(path).resolve(), self.certificate_keys())
+
+    def certificate_keys(self):
+        """Ключи тегов '[data]' шаблона izvedeno (line_items.template_keys); без шаблона — None."""
+        if not (self.root / "templates" / "izvedeno_template.xlsx").exists():
+            return None
+        from line_items import template_keys
+        return template_keys(self)
+
+    def certificate_values(self, path: Path, keys) -> dict:
+        """Значения тегов izvedeno по ключам шаблона (компактный кэш certificate_cache)."""
+        return self.certificate_cache.key_values(Path(path).resolve(), keys)
+
+    @property
+    def certificate_cache(self):
+        if self._certificate_cache is None:
+            self._certificate_cache = CertificateCache(self.root)
+        return self._certificate_cache
+
+    def certificate_frame(self, path: Path):
+        """Столбцы Name и сумм листа 'Completion certificate' как DataFrame (как pd.read_excel)."""
+        import pandas as pd
+        cert = self.certificate(path)
+        if AMOUNT_SHEET not in cert["sheets"]:
+            raise ValueError(f"Worksheet named '{AMOUNT_SHEET}' not found")
+        columns = {}
+        for name, values in ((NAME_COLUMN, cert["names"]), (AMOUNT_COLUMN, cert["amounts"])):
+            if values is None:
+                raise ValueError(f"Column '{name}' not found in {Path(path).name}")
+            columns[name] = pd.Series(values)
+        return pd.DataFrame(columns)
+
+    # Курсы
+
+    @property
+    def rates(self):
+        """Таблица курсов евро проекта (exchange_rates), пока файл не изменился."""
+        from exchange_rates import load_rates, rates_path
+        return _fresh(self._rates, None, rates_path(self.root), lambda: load_rates(self.root))
+
+    def advance_day(self, template: Path):
+        """Дата авансного счёта из шаблона situacija (exchange_rates.advance_date)."""
+        from exchange_rates import advance_date
+        key = Path(template).resolve()
+        return _fresh(self._advance_days, key, key, lambda: advance_date(key))
+
+    # Шаблоны
+
+    def template_bytes(self, path: Path) -> bytes:
+        key = Path(path).resolve()
+        return _fresh(self._templates, key, key, key.read_bytes)
+
+    def copy_template(self, template: Path, dest: Path):
+        """Копия шаблона из памяти (вместо shutil.copy с диска), атомарно."""
+        dest = Path(dest)
+        tmp = dest.with_name(dest.name + ".tmp")
+        with file_timer("write", dest):
+            tmp.write_bytes(self.template_bytes(template))
+            os.replace(tmp, dest)
+
+    def template_clone(self, path: Path, template_map: dict = None):
+        """Шаблон, разобранный один раз, для клонирования отчётов в памяти (xlsx_clone)."""
+        key = Path(path).resolve()
+        return _fresh(self._clones, key, key, lambda: TemplateClone(self.template_bytes(key), template_map))
+
+    def template_map(self, path: Path, tags, key_column: int = 2) -> dict:
+        """Карта тегов шаблона (см. template_compiler), пока шаблон не изменился."""
+        key = (Path(path).resolve(), tuple(sorted(set(tags))), key_column)
+        return _fresh(
+            self._template_maps, key, key[0], lambda: load_template_map(self.root, path, tags, key_column)
+        )
+
+
+def _fresh(store: dict, key, path: Path, load):
+    """
+    Значение из store[key], если файл path не изменился с загрузки (размер,
+    mtime); иначе load() заново. Отсутствующий файл — свой отпечаток (None).
+    """
+    try:
+        stamp = file_stamp(path)
+    except OSError:
+        stamp = None
+    entry = store.get(key)
+    if entry is None or entry[0] != stamp:
+        entry = store[key] = (stamp, load())
+    return entry[1]
+
+
+def resolve_context(ctx, script_file: str):
+    """
+    Возвращает (контекст, создан_здесь). Без переданного контекста создаётся
+    новый для корня проекта (родителя папки scripts).
+    """
+    if ctx is not None:
+        return ctx, False
+    return PipelineContext(Path(script_file).resolve().parent.parent), True
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+preflight.py
+
+Быстрая проверка новых сертификатов из Input до их разбора (2_journal):
+читаются только имя файла, оглавление архива, workbook.xml (имена листов)
+и строка заголовков листа 'Completion certificate'. Файлы проверяются
+параллельно в потоках (io_pipeline.prefetch), так что одна битая выгрузка
+отсеивается сразу, а не после полного разбора.
+
+Отклонённый файл — словарь {"file", "reason", "detail"}; причины:
+  bad_filename    — имя не вида '<...>_Progress_certificate_<номер>_<дата>.xlsx'
+  bad_date        — дата в имени не читается (нужна 'дд.мм.гггг')
+  not_xlsx        — не архив xlsx (другой формат, повреждён, не докопирован)
+  missing_sheet   — нет листа 'Completion certificate'
+  missing_columns — в заголовке листа нет столбцов 'Name' или
+                    'Amount in certificate with VAT'
+
+Наличие строк 'Radovi' / 'RADOVI PO PONUDI' по заголовку не проверить —
+это по-прежнему делает extract_total_amount при разборе.
+"""
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+from certificate_cache import AMOUNT_COLUMN, AMOUNT_SHEET, NAME_COLUMN
+from io_pipeline import prefetch
+from xlsx_cells import first_row, sheet_parts
+
+CERTIFICATE_MARKER = "_Progress_certificate_"
+DATE_FORMAT = "%d.%m.%Y"
+
+
+def parse_filename(fn: str):
+    stem = Path(fn).stem
+    if CERTIFICATE_MARKER not in stem:
+        raise ValueError(f"Unexpected filename format: {fn}")
+    _, rest = stem.split(CERTIFICATE_MARKER, 1)
+    parts = rest.split("_", 1)
+    return parts[0], parts[1]
+
+
+def _reject(path: Path, reason: str, detail: str) -> dict:
+    return {"file": path.name, "reason": reason, "detail": detail}
+
+
+def check_certificate(path: Path):
+    """Отклонение для файла (словарь) или None, если файл можно разбирать."""
+    path = Path(path)
+    try:
+        _, cert_date = parse_filename(path.name)
+    except (ValueError, IndexError):
+        return _reject(path, "bad_filename", f"expected '<...>{CERTIFICATE_MARKER}<number>_<dd.mm.yyyy>.xlsx'")
+    try:
+        datetime.strptime(cert_date, DATE_FORMAT)
+    except ValueError:
+        return _reject(path, "bad_date", f"unrecognised certificate date '{cert_date}'")
+
+    try:
+        with zipfile.ZipFile(path) as zf:
+            parts = dict(sheet_parts(zf)[0])
+            if AMOUNT_SHEET not in parts:
+                return _reject(path, "missing_sheet", f"no sheet '{AMOUNT_SHEET}' (sheets: {', '.join(parts)})")
+            header = first_row(zf, parts[AMOUNT_SHEET])
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, OSError) as e:
+        return _reject(path, "not_xlsx", f"{type(e).__name__}: {e}")
+
+    missing = [col for col in (NAME_COLUMN, AMOUNT_COLUMN) if col not in header]
+    if missing:
+        return _reject(path, "missing_columns", f"header of '{AMOUNT_SHEET}' lacks {', '.join(missing)}")
+    return None
+
+
+def preflight(files) -> list:
+    """Отклонённые файлы (в порядке files); проверка идёт параллельно в потоках."""
+    return [rejection for _, rejection in prefetch(files, check_certificate) if rejection]
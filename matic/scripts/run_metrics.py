@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_metrics.py
+
+Замеры запуска для отчёта <root>/run_report.json (рядом с папкой Output):
+  - время от старта раннера до первого этапа
+  - по каждому этапу: время импорта скрипта, время (wall), процессорное
+    время, пиковая память
+  - по каждому открытию/сохранению книги: операция, файл, время
+
+Пиковая память — максимум рабочего набора процесса (peak RSS) после этапа;
+это максимум за весь запуск, поэтому рост от этапа к этапу показывает, какой
+этап его поднял. С trace_memory=True дополнительно пишется пик выделений
+Python внутри этапа (tracemalloc; заметно замедляет работу).
+
+Файлы замеряются через file_timer(...) в местах, где книги читаются и
+пишутся. Вне запуска с отчётом (скрипт запущен отдельно) file_timer ничего
+не записывает. Процессы пула собирают замеры через collect_files() и
+возвращают их в основной процесс (add_files).
+"""
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+REPORT_NAME = "run_report.json"
+
+# Куда пишутся замеры файлов: список текущего отчёта или сборщика в процессе пула
+_files = None
+_stage = None
+
+
+def peak_rss_bytes():
+    """Пиковый рабочий набор процесса в байтах (None, если узнать нельзя)."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if get_info(handle, ctypes.byref(counters), counters.cb):
+            return int(counters.PeakWorkingSetSize)
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def record_file(op: str, path, seconds: float):
+    if _files is not None:
+        _files.append({"stage": _stage, "op": op, "file": str(path), "seconds": round(seconds, 6)})
+
+
+@contextmanager
+def file_timer(op: str, path):
+    """Замер одной операции с книгой: with file_timer("open", path): ..."""
+    if _files is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_file(op, path, time.perf_counter() - t0)
+
+
+@contextmanager
+def collect_files(stage: str = None):
+    """Сбор замеров файлов в отдельный список (для процессов пула)."""
+    global _files, _stage
+    saved = _files, _stage
+    _files, _stage = [], stage
+    try:
+        yield _files
+    finally:
+        _files, _stage = saved
+
+
+def current_stage():
+    return _stage
+
+
+def add_files(entries):
+    """Добавляет замеры, собранные в другом процессе."""
+    if _files is not None:
+        _files.extend(entries)
+
+
+class RunReport:
+    def __init__(self, root: Path, trace_memory: bool = False):
+        self.root = Path(root)
+        self.trace_memory = trace_memory
+        self.started = datetime.now()
+        self.stages = []
+        self.files = []
+        self.profiles = {}
+        self.status = "ok"
+        self.startup_seconds = None
+
+    @contextmanager
+    def stage(self, name: str, profile: bool = False):
+        """Замер этапа; при profile=True этап выполняется под cProfile."""
+        global _files, _stage
+        _files, _stage = self.files, name
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        entry = {"stage": name, "status": "ok"}
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield entry
+        except BaseException:
+            entry["status"] = "error"
+            self.status = "error"
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            entry["wall_seconds"] = round(time.perf_counter() - wall0, 6)
+            entry["cpu_seconds"] = round(time.process_time() - cpu0, 6)
+            entry["peak_rss_bytes"] = peak_rss_bytes()
+            if self.trace_memory:
+                entry["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            entry["files"] = sum(1 for f in self.files if f["stage"] == name)
+            self.stages.append(entry)
+            if profiler:
+                self.profiles[name] = self._save_profile(name, profiler)
+            _files, _stage = None, None
+
+    def _save_profile(self, name: str, profiler) -> str:
+        """Сохраняет профиль этапа (.prof для snakeviz/pstats и текстовую сводку)."""
+        import pstats
+        base = self.root / f"profile_{Path(name).stem}"
+        profiler.dump_stats(f"{base}.prof")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        Path(f"{base}.txt").write_text(out.getvalue(), encoding="utf-8")
+        print(f"Profile saved: {base}.prof")
+        return f"{base.name}.prof"
+
+    def _relative(self, path: str) -> str:
+        try:
+            return Path(path).resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return path
+
+    def save(self) -> Path:
+        """Записывает отчёт атомарно и возвращает путь к нему."""
+        report = {
+            "started": self.started.isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "status": self.status,
+            "pid": os.getpid(),
+            "startup_seconds": self.startup_seconds,
+            "stages": self.stages,
+            "files": [dict(f, file=self._relative(f["file"])) for f in self.files],
+            "profiles": self.profiles,
+        }
+        path = self.root / REPORT_NAME
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        return path
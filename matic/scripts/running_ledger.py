@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+running_ledger.py
+
+Книга нарастающих итогов для полей situacija ([previous_total],
+[all_total_on date], [total_amount_din]) вместо сортировки журнала и
+cumsum по всей истории на каждом запуске.
+
+  - счета упорядочены по дате сертификата; счета одной даты — в порядке
+    добавления в книгу (как устойчивая сортировка журнала)
+  - суммы хранятся в деревьях Фенвика по дням (день — позиция в дереве),
+    поэтому вставка и запрос "итог на дату" — O(log n)
+  - суммы — целые микроединицы (10⁻⁶ евро/динара): итог не зависит от
+    порядка сложения и не накапливает ошибку округления float
+  - sync(rows) сверяет книгу с журналом и возвращает счета, у которых из-за
+    вставки задним числом, изменения суммы или даты более раннего счёта
+    поменялись предыдущие итоги, — только их нужно пересобрать
+
+Книга хранится в <root>/.cache/running_ledger.json (счёт -> день, порядковый
+номер, суммы); деревья перестраиваются при загрузке.
+"""
+from bisect import bisect_right, insort
+from pathlib import Path
+
+import numpy as np
+
+from exchange_rates import to_day
+from file_cache import cache_dir, load_json, save_json
+
+LEDGER_NAME = "running_ledger.json"
+# Дни считаются от EPOCH; CAPACITY дней (~179 лет) — размер деревьев
+EPOCH = np.datetime64("1990-01-01", "D")
+CAPACITY = 1 << 16
+SCALE = 10 ** 6
+
+
+def to_units(value) -> int:
+    """Сумма в микроединицах; пропуск (None, NaN, не число) — 0, как fillna(0)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if value != value:
+        return 0
+    return round(value * SCALE)
+
+
+def from_units(units: int) -> float:
+    return units / SCALE
+
+
+def day_of(cert_date) -> int:
+    """Позиция дня в деревьях для даты сертификата ('дд.мм.гггг', ISO или date)."""
+    day = to_day(cert_date)
+    if np.isnat(day):
+        raise ValueError(f"Unrecognised certificate date: {cert_date!r}")
+    pos = int((day - EPOCH).astype(int)) + 1
+    if not 1 <= pos < CAPACITY:
+        raise ValueError(f"Certificate date out of ledger range: {cert_date}")
+    return pos
+
+
+class Fenwick:
+    """Дерево Фенвика над целыми: add и prefix за O(log n)."""
+
+    def __init__(self, size: int = CAPACITY):
+        self.tree = [0] * size
+
+    def add(self, pos: int, delta: int):
+        tree = self.tree
+        while pos < len(tree):
+            tree[pos] += delta
+            pos += pos & -pos
+
+    def prefix(self, pos: int) -> int:
+        """Сумма позиций 1..pos."""
+        tree = self.tree
+        total = 0
+        while pos > 0:
+            total += tree[pos]
+            pos -= pos & -pos
+        return total
+
+
+class RunningLedger:
+    def __init__(self, entries: dict = None, next_seq: int = 0):
+        self.entries = {}      # счёт -> {"day", "seq", "eur", "din"}
+        self.next_seq = next_seq
+        self._eur = Fenwick()
+        self._din = Fenwick()
+        self._days = []        # дни со счетами, по возрастанию
+        self._by_day = {}      # день -> [счета в порядке seq]
+        for invoice, entry in (entries or {}).items():
+            self._insert(invoice, dict(entry))
+
+    # Хранение
+
+    @classmethod
+    def load(cls, root: Path) -> "RunningLedger":
+        data = load_json(cache_dir(root) / LEDGER_NAME, None) or {}
+        ledger = cls(data.get("entries"), data.get("next_seq", 0))
+        ledger.root = Path(root)
+        ledger.is_new = not data
+        return ledger
+
+    def save(self, root: Path = None):
+        root = root or self.root
+        save_json(cache_dir(root) / LEDGER_NAME, {"entries": self.entries, "next_seq": self.next_seq})
+
+    # Изменения
+
+    def _insert(self, invoice, entry):
+        day = entry["day"]
+        self.entries[invoice] = entry
+        self._eur.add(day, entry["eur"])
+        self._din.add(day, entry["din"])
+        if day not in self._by_day:
+            self._by_day[day] = []
+            insort(self._days, day)
+        same_day = self._by_day[day]
+        same_day.append(invoice)
+        same_day.sort(key=lambda inv: self.entries[inv]["seq"])
+        self.next_seq = max(self.next_seq, entry["seq"] + 1)
+
+    def _remove(self, invoice):
+        entry = self.entries.pop(invoice)
+        day = entry["day"]
+        self._eur.add(day, -entry["eur"])
+        self._din.add(day, -entry["din"])
+        self._by_day[day].remove(invoice)
+        if not self._by_day[day]:
+            del self._by_day[day]
+            self._days.remove(day)
+        return entry
+
+    def sort_key(self, invoice):
+        entry = self.entries[invoice]
+        return entry["day"], entry["seq"]
+
+    def after(self, key) -> list:
+        """Счета строго после позиции key = (день, seq), по порядку."""
+        day, seq = key
+        result = [inv for inv in self._by_day.get(day, []) if self.entries[inv]["seq"] > seq]
+        for d in self._days[bisect_right(self._days, day):]:
+            result.extend(self._by_day[d])
+        return result
+
+    def upsert(self, invoice, cert_date, eur, din) -> set:
+        """
+        Добавляет или обновляет счёт; возвращает счета (уже бывшие в книге),
+        чьи предыдущие итоги от этого изменились.
+        """
+        day = day_of(cert_date)
+        eur, din = to_units(eur), to_units(din)
+        old = self.entries.get(invoice)
+        if old is not None and (old["day"], old["eur"], old["din"]) == (day, eur, din):
+            return set()
+
+        if old is None:
+            entry = {"day": day, "seq": self.next_seq, "eur": eur, "din": din}
+            self._insert(invoice, entry)
+            return set(self.after((day, entry["seq"])))
+
+        old_key = (old["day"], old["seq"])
+        self._remove(invoice)
+        self._insert(invoice, {"day": day, "seq": old["seq"], "eur": eur, "din": din})
+        new_key = (day, old["seq"])
+        invalidated = set(self.after(min(old_key, new_key)))
+        if new_key != old_key or old["eur"] != eur:
+            # Счёт переехал или изменилась его сумма: меняются и его
+            # собственные итоги ([all_total_on date])
+            invalidated.add(invoice)
+        return invalidated
+
+    def remove(self, invoice) -> set:
+        entry = self._remove(invoice)
+        return set(self.after((entry["day"], entry["seq"])))
+
+    def sync(self, rows) -> set:
+        """
+        Сверяет книгу со строками журнала (Invoice, Certificate Date, Total
+        Amount, Total Amount Din). Возвращает счета, которые нужно пересобрать
+        из-за изменений раньше них по дате. Новые счета в ответ не входят
+        (их отчёты создаются впервые), как и всё при первом построении книги.
+        """
+        is_new = getattr(self, "is_new", False)
+        invalidated = set()
+        present = set()
+        for row in rows:
+            invoice = row.get("Invoice")
+            present.add(invoice)
+            invalidated |= self.upsert(
+                invoice, row.get("Certificate Date"), row.get("Total Amount"), row.get("Total Amount Din")
+            )
+        for invoice in set(self.entries) - present:
+            invalidated |= self.remove(invoice)
+        invalidated &= set(self.entries)
+        self.is_new = False
+        return set() if is_new else invalidated
+
+    # Запросы
+
+    def previous(self, invoice):
+        """(евро, динары) по всем счетам до этого (без него самого)."""
+        entry = self.entries[invoice]
+        day, seq = entry["day"], entry["seq"]
+        eur = self._eur.prefix(day - 1)
+        din = self._din.prefix(day - 1)
+        for inv in self._by_day[day]:
+            other = self.entries[inv]
+            if other["seq"] >= seq:
+                break
+            eur += other["eur"]
+            din += other["din"]
+        return from_units(eur), from_units(din)
+
+    def through(self, invoice):
+        """(евро, динары) по этому счёту включительно."""
+        eur, din = self.previous(invoice)
+        entry = self.entries[invoice]
+        return eur + from_units(entry["eur"]), din + from_units(entry["din"])
+
+    def as_of(self, cert_date):
+        """(евро, динары) по всем счетам с датой не позже cert_date."""
+        day = day_of(cert_date)
+        return from_units(self._eur.prefix(day)), from_units(self._din.prefix(day))
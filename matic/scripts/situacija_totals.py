@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+situacija_totals.py
+
+Итоги situacija по строкам журнала без Excel и без открытия отчётов.
+
+  - теги шаблона situacija_template.xlsx и колонки журнала, из которых они
+    заполняются (общие с 3_situacija)
+  - значения тегов для всего журнала: нарастающие итоги берутся из книги
+    running_ledger, как в 3_situacija (ledger_totals)
+  - формулы шаблона (D32 — сумма в динарах, и остальные итоги) вычисляются
+    formula_eval пакетно для всех строк: граф формул строится один раз на
+    шаблон, значения тегов подставляются во входные ячейки
+
+Курсы строк берутся из таблицы курсов (exchange_rates) или, если её нет для
+даты, из курсов, введённых вручную в situacija (1_journal_update).
+"""
+import math
+from pathlib import Path
+
+import numpy as np
+
+from exchange_rates import rates_for
+from formula_eval import load_graph
+from running_ledger import RunningLedger
+
+TEMPLATE_NAME = "situacija_template.xlsx"
+
+# Теги шаблона situacija -> колонки журнала (и расчётные колонки)
+TAG_COLUMNS = {
+    "[date]":              "Certificate Date",
+    "[number]":            "Certificate Number",
+    "[current_total]":     "Total Amount",
+    "[previous_total]":    "previous_total",
+    "[all_total_on date]": "all_total_on_date",
+    "[total_amount_din]":  "previous_total_din",
+    "[advance_rate_exchange]": "Advance Rate",
+    "[bill_rate_exchange]":    "Total Rate",
+}
+NUMERIC_TAGS = {
+    "[current_total]",
+    "[previous_total]",
+    "[all_total_on date]",
+    "[total_amount_din]",
+    "[advance_rate_exchange]",
+    "[bill_rate_exchange]",
+}
+# Курсы, которых нет в таблице курсов, вводятся в отчёт вручную — тег остаётся
+MANUAL_TAGS = {"[advance_rate_exchange]", "[bill_rate_exchange]"}
+RATE_TAGS = {"Advance Rate": "[advance_rate_exchange]", "Total Rate": "[bill_rate_exchange]"}
+
+TOTAL_DIN_CELL = "D32"
+# Итоги листа: суммы в евро и динарах по строкам 28–36
+TOTAL_CELLS = ("D28", "D31", "D32", "D33", "D34", "D35", "D36")
+
+
+def template_path(root: Path) -> Path:
+    return Path(root) / "templates" / TEMPLATE_NAME
+
+
+def parse_rate(value) -> float:
+    """Курс из журнала или ячейки отчёта; не число (в т. ч. тег) — NaN."""
+    if isinstance(value, bool):
+        return math.nan
+    if isinstance(value, str):
+        value = value.strip().replace(",", ".")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def rate_cells(template_map: dict) -> dict:
+    """Ячейки курсов, вводимых вручную: {тег: (лист, адрес)} по карте шаблона."""
+    return {
+        loc["tag"]: (loc["sheet"], loc["cell"])
+        for loc in template_map["cells"]
+        if loc["tag"] in RATE_TAGS.values()
+    }
+
+
+def _numbers(values) -> np.ndarray:
+    def number(v):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return np.nan
+    return np.array([number(v) for v in values], dtype=float)
+
+
+def ledger_totals(ledger, rows):
+    """
+    Итоги строк по книге нарастающих итогов (running_ledger) — общие с
+    3_situacija: (previous_total, all_total_on_date, previous_total_din).
+    """
+    totals = [ledger.previous(r.get("Invoice")) for r in rows]
+    amounts = _numbers(r.get("Total Amount") for r in rows)
+    previous = np.array([eur for eur, _ in totals], dtype=float)
+    previous_din = np.array([din for _, din in totals], dtype=float)
+    # Пропуск суммы остаётся пропуском в [all_total_on date]
+    return previous, previous + amounts, previous_din
+
+
+def tag_values(rows, advance_rates, bill_rates, ledger=None) -> dict:
+    """
+    {тег: массив значений по строкам} в порядке rows. Без ledger книга
+    строится по rows (счета одной даты — в порядке rows).
+    """
+    if ledger is None:
+        ledger = RunningLedger()
+        ledger.sync(rows)
+    totals = _numbers(r.get("Total Amount") for r in rows)
+    previous, cumulative, previous_din = ledger_totals(ledger, rows)
+
+    columns = {
+        "Certificate Date": [r.get("Certificate Date") for r in rows],
+        "Certificate Number": [r.get("Certificate Number") for r in rows],
+        "Total Amount": totals,
+        "previous_total": previous,
+        "all_total_on_date": cumulative,
+        "previous_total_din": previous_din,
+        "Advance Rate": np.asarray(advance_rates, dtype=float),
+        "Total Rate": np.asarray(bill_rates, dtype=float),
+    }
+    return {tag: columns[col] for tag, col in TAG_COLUMNS.items()}
+
+
+def _input_values(text: str, values: dict, size: int):
+    """Значения входной ячейки шаблона с тегами после подстановки (как xlsx_tags)."""
+    lowered = text.lower()
+    found = [tag for tag in values if tag.lower() in lowered]
+    if not found:
+        return None
+    if len(found) == 1 and text.strip().lower() == found[0].lower():
+        return values[found[0]]
+    result = []
+    for i in range(size):
+        cell = text
+        for tag in found:
+            value = values[tag][i]
+            missing = value is None or (isinstance(value, float) and math.isnan(value))
+            cell = cell.replace(tag, "" if missing else str(value))
+        result.append(cell)
+    return result
+
+
+def evaluate(root: Path, rows, advance_rates, bill_rates, targets=TOTAL_CELLS) -> dict:
+    """
+    Итоги шаблона для всех строк журнала: {ячейка: массив по строкам};
+    NaN — значение не вычисляется (нет курса и т. п.).
+    """
+    template = template_path(root)
+    graph = load_graph(template, targets)
+    values = tag_values(rows, advance_rates, bill_rates)
+    inputs = {}
+    for ref in graph.inputs:
+        text = graph.constants[ref]
+        if isinstance(text, str):
+            bound = _input_values(text, values, len(rows))
+            if bound is not None:
+                inputs[ref] = bound
+    return graph.evaluate(inputs, len(rows))
+
+
+def table_rates(ctx, rows):
+    """Курсы строк из таблицы курсов: (курс аванса, курс на дату сертификата)."""
+    template = template_path(ctx.root)
+    advance_day = ctx.advance_day(template) if template.exists() else None
+    return rates_for(ctx.rates, [r.get("Certificate Date") for r in rows], advance_day)
+
+
+def dinar_updates(ctx, rows, advance_rates, bill_rates) -> dict:
+    """
+    Изменения журнала {Invoice: {колонка: значение}} для строк, где курсы
+    известны и сумма в динарах вычисляется.
+    """
+    if not rows or not template_path(ctx.root).exists():
+        return {}
+    din = evaluate(ctx.root, rows, advance_rates, bill_rates, (TOTAL_DIN_CELL,))[TOTAL_DIN_CELL]
+    updates = {}
+    for row, advance_rate, bill_rate, amount in zip(rows, advance_rates, bill_rates, din):
+        if math.isnan(advance_rate) or math.isnan(bill_rate) or math.isnan(amount):
+            continue
+        values = {
+            "Advance Rate": float(advance_rate),
+            "Total Rate": float(bill_rate),
+            "Total Amount Din": float(amount),
+        }
+        if any(row.get(col) != value for col, value in values.items()):
+            updates[row.get("Invoice")] = values
+    return updates
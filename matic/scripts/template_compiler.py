@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+template_compiler.py
+
+Разовый разбор шаблонов (situacija_template.xlsx, izvedeno_template.xlsx):
+где именно в шаблоне стоят теги ('[date]', '[data]', '[extra_hours]', ...).
+
+Результат — карта тегов:
+  - cells   — ячейки с тегами в порядке обхода листов (лист, адрес, строка,
+              столбец, тег, значение ключевой ячейки той же строки, по
+              умолчанию столбца B)
+  - strings — индексы общих строк (sharedStrings.xml), содержащих теги
+  - parts   — части архива (XML листов), в которых есть теги
+
+Карта хранится в <root>/.cache/template_maps.json и пересобирается только
+при изменении содержимого шаблона (хэш), набора тегов или ключевого столбца.
+В пределах процесса карты запоминаются по хэшу шаблона, так что проекты с
+одинаковыми шаблонами (start.py --projects) разбирают их один раз.
+Теги ищутся без учёта регистра, как Selection.Replace в Excel.
+"""
+import re
+import zipfile
+from pathlib import Path
+
+from file_cache import cache_dir, file_digest, load_json, save_json
+from xlsx_cells import iter_cells, shared_strings, sheet_parts
+
+CACHE_NAME = "template_maps.json"
+
+# Разобранные в этом процессе карты: (хэш, теги, ключевой столбец) -> карта
+_compiled = {}
+
+
+def compile_template(path: Path, tags, key_column: int = 2) -> dict:
+    """Разбирает шаблон и возвращает карту тегов (без кэша)."""
+    tags = sorted(set(tags))
+    pattern = re.compile(
+        "|".join(re.escape(t) for t in sorted(tags, key=len, reverse=True)), re.IGNORECASE
+    )
+    canonical = {t.lower(): t for t in tags}
+
+    def found_tags(text):
+        return list(dict.fromkeys(canonical[m.group(0).lower()] for m in pattern.finditer(text)))
+
+    cells = []
+    parts = []
+    with zipfile.ZipFile(path) as zf:
+        strings = shared_strings(zf)
+        tagged = {idx: found_tags(text) for idx, text in strings.items()}
+        tagged = {idx: found for idx, found in tagged.items() if found}
+
+        def text_of(kind, value):
+            return strings.get(value) if kind == "s" else value
+
+        for sheet, part in sheet_parts(zf)[0]:
+            row_keys = {}
+            row_tags = []
+            for row, col, ref, kind, value in iter_cells(zf, part, formulas=True):
+                if col == key_column:
+                    row_keys[row] = text_of(kind, value)
+                if kind == "s":
+                    found = tagged.get(value, [])
+                elif isinstance(value, str):
+                    found = found_tags(value)
+                else:
+                    found = []
+                for tag in found:
+                    row_tags.append({
+                        "sheet": sheet, "cell": ref, "row": row, "column": col,
+                        "tag": tag, "string": value if kind == "s" else None,
+                    })
+            for loc in row_tags:
+                loc["key"] = row_keys.get(loc["row"])
+            if row_tags:
+                parts.append(part)
+            cells.extend(row_tags)
+
+    return {
+        "tags": tags,
+        "key_column": key_column,
+        "cells": cells,
+        "strings": sorted(tagged),
+        "parts": parts,
+    }
+
+
+def load_template_map(root: Path, path: Path, tags, key_column: int = 2) -> dict:
+    """Карта тегов шаблона из кэша; при изменении шаблона — разбирает заново."""
+    path = Path(path)
+    cache_fp = cache_dir(root) / CACHE_NAME
+    cache = load_json(cache_fp, None) or {}
+    digest = file_digest(path)
+
+    entry = cache.get(path.name)
+    if (
+        entry is not None
+        and entry.get("hash") == digest
+        and entry.get("tags") == sorted(set(tags))
+        and entry.get("key_column") == key_column
+    ):
+        return entry
+
+    memo_key = (digest, tuple(sorted(set(tags))), key_column)
+    entry = _compiled.get(memo_key)
+    if entry is None:
+        entry = compile_template(path, tags, key_column)
+        entry["hash"] = digest
+        _compiled[memo_key] = entry
+        print(f"Template compiled: {path.name} ({len(entry['cells'])} tag cells)")
+    cache[path.name] = entry
+    save_json(cache_fp, cache)
+    return entry
+
+
+def cells_by_sheet(template_map: dict, tag: str = None) -> dict:
+    """{лист: [ячейки с тегом tag (или со всеми тегами)]} в порядке обхода."""
+    result = {}
+    for loc in template_map["cells"]:
+        if tag is None or loc["tag"] == tag:
+            result.setdefault(loc["sheet"], []).append(loc)
+    return result
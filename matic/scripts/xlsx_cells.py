@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xlsx_cells.py
+
+Чтение значений нескольких ячеек с фиксированными адресами из xlsx
+без загрузки всей книги.
+
+Из архива читаются только workbook.xml (+ связи), XML нужных листов
+и, если среди найденных ячеек есть строки, sharedStrings.xml. Листы
+разбираются потоково и дочитываются только до последней нужной строки.
+
+Значения соответствуют openpyxl с data_only=True: для формул
+возвращается сохранённый результат последнего пересчёта.
+"""
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+_REF_RE = re.compile(r"([A-Z]+)(\d+)")
+
+
+def _row_of(ref: str) -> int:
+    return int(_REF_RE.fullmatch(ref).group(2))
+
+
+def _col_index(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def sheet_parts(zf: zipfile.ZipFile):
+    """Возвращает (список (имя листа, путь части) в порядке книги, индекс активного листа)."""
+    wb = ET.fromstring(zf.read("xl/workbook.xml"))
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {r.get("Id"): r.get("Target") for r in rels.iter(f"{PKG_REL_NS}Relationship")}
+
+    parts = []
+    for sh in wb.iter(f"{NS}sheet"):
+        target = targets[sh.get(f"{REL_NS}id")]
+        if target.startswith("/"):
+            part = target.lstrip("/")
+        else:
+            part = posixpath.normpath(posixpath.join("xl", target))
+        parts.append((sh.get("name"), part))
+
+    active = 0
+    view = wb.find(f"{NS}bookViews/{NS}workbookView")
+    if view is not None:
+        active = int(view.get("activeTab", 0))
+    return parts, active
+
+
+def _cell_value(elem, formulas: bool):
+    """Сырое значение ячейки: ('s', индекс) для общих строк, иначе ('v', значение)."""
+    t = elem.get("t", "n")
+    v = elem.find(f"{NS}v")
+    if t == "inlineStr":
+        return "v", "".join(x.text or "" for x in elem.iter(f"{NS}t"))
+    if v is None or v.text is None:
+        f = elem.find(f"{NS}f")
+        if formulas and f is not None:
+            return "v", "=" + (f.text or "")
+        return "v", None
+    text = v.text
+    if t == "s":
+        return "s", int(text)
+    if t == "b":
+        return "v", text == "1"
+    if t in ("str", "e"):
+        return "v", text
+    if "." in text or "E" in text or "e" in text:
+        return "v", float(text)
+    return "v", int(text)
+
+
+def _shared_strings(zf: zipfile.ZipFile, wanted: set):
+    """Читает только нужные элементы sharedStrings.xml (по индексам; None — все)."""
+    result = {}
+    if wanted is not None and not wanted:
+        return result
+    if wanted is None:
+        if "xl/sharedStrings.xml" not in zf.namelist():
+            return result
+        last = float("inf")
+    else:
+        last = max(wanted)
+    idx = 0
+    with zf.open("xl/sharedStrings.xml") as fh:
+        for _, elem in ET.iterparse(fh, events=("end",)):
+            if elem.tag != f"{NS}si":
+                continue
+            if wanted is None or idx in wanted:
+                # Простая строка — один <t>; rich text — <r><t> по фрагментам
+                t = elem.find(f"{NS}t")
+                if t is not None:
+                    result[idx] = t.text or ""
+                else:
+                    result[idx] = "".join(x.text or "" for x in elem.iterfind(f"{NS}r/{NS}t"))
+            elem.clear()
+            if idx >= last:
+                break
+            idx += 1
+    return result
+
+
+def shared_strings(zf: zipfile.ZipFile) -> dict:
+    """Все общие строки книги: {индекс: текст}."""
+    return _shared_strings(zf, None)
+
+
+def iter_cells(zf: zipfile.ZipFile, part: str, formulas: bool = False):
+    """
+    Потоково перебирает непустые ячейки листа (часть архива part):
+    (строка, столбец, адрес, вид, значение), где вид 's' — значение является
+    индексом общей строки, 'v' — самим значением.
+    """
+    with zf.open(part) as fh:
+        for _, elem in ET.iterparse(fh, events=("end",)):
+            if elem.tag == f"{NS}c":
+                ref = elem.get("r")
+                kind, value = _cell_value(elem, formulas)
+                if value is not None:
+                    m = _REF_RE.fullmatch(ref)
+                    yield int(m.group(2)), _col_index(m.group(1)), ref, kind, value
+                elem.clear()
+            elif elem.tag == f"{NS}row":
+                elem.clear()
+
+
+def first_row(zf: zipfile.ZipFile, part: str) -> list:
+    """
+    Значения первой непустой строки листа (заголовок) по порядку столбцов;
+    лист дочитывается только до её конца, общие строки — только нужные.
+    """
+    row_num = None
+    cells = []
+    for row, col, _, kind, value in iter_cells(zf, part):
+        if row_num is None:
+            row_num = row
+        elif row != row_num:
+            break
+        cells.append((col, kind, value))
+    strings = _shared_strings(zf, {value for _, kind, value in cells if kind == "s"})
+    return [strings.get(value) if kind == "s" else value for _, kind, value in sorted(cells)]
+
+
+def read_cells(path, addresses, formulas: bool = False):
+    """
+    Читает ячейки по адресам [(лист, 'D32'), ...]; лист None — активный лист.
+
+    Возвращает {(лист, адрес): значение}. Для отсутствующих листов ключей
+    в результате нет, пустые ячейки дают None. При formulas=True для формул
+    без сохранённого результата возвращается текст формулы ('=...').
+    """
+    by_sheet = {}
+    for sheet, ref in addresses:
+        by_sheet.setdefault(sheet, set()).add(ref.upper())
+
+    raw = {}
+    with zipfile.ZipFile(path) as zf:
+        parts, active = sheet_parts(zf)
+        part_of = dict(parts)
+
+        for sheet, refs in by_sheet.items():
+            name = parts[active][0] if sheet is None else sheet
+            if name not in part_of:
+                continue
+            for ref in refs:
+                raw[(sheet, ref)] = ("v", None)
+
+            pending = set(refs)
+            last_row = max(_row_of(r) for r in refs)
+            with zf.open(part_of[name]) as fh:
+                for _, elem in ET.iterparse(fh, events=("end",)):
+                    if elem.tag == f"{NS}c":
+                        ref = elem.get("r")
+                        if ref in pending:
+                            raw[(sheet, ref)] = _cell_value(elem, formulas)
+                            pending.discard(ref)
+                    elif elem.tag == f"{NS}row":
+                        row_num = int(elem.get("r", 0))
+                        elem.clear()
+                        if not pending or row_num >= last_row:
+                            break
+
+        wanted = {v for kind, v in raw.values() if kind == "s"}
+        strings = _shared_strings(zf, wanted)
+
+    return {
+        key: strings.get(v) if kind == "s" else v
+        for key, (kind, v) in raw.items()
+    }
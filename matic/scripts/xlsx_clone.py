@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xlsx_clone.py
+
+Клонирование шаблона отчёта в памяти: шаблон читается один раз (части
+архива — bytes), а каждый отчёт получает неглубокую копию словаря частей,
+в которой заменяются только изменённые XML. Неизменённые части (стили,
+тема, остальные листы) пишутся в отчёт как есть, без разбора.
+
+Запись — сразу в итоговый путь через временный файл и rename
+(xlsx_tags.write_parts), так что прерванный запуск не оставит полузаписанный
+отчёт.
+
+drop_cached_values=True повторяет то, что делает openpyxl при сохранении
+книги с формулами: сохранённые результаты формул удаляются, цепочка
+вычислений (calcChain.xml) выбрасывается, и в workbook.xml ставится
+fullCalcOnLoad — Excel пересчитает книгу и построит цепочку при открытии.
+Без calcChain формулу в клоне можно заменить значением (set_numbers).
+"""
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from xlsx_cells import NS, read_cells, sheet_parts
+from xlsx_tags import WORKBOOK, _force_full_calc, write_parts
+
+_CACHED_VALUE_RE = re.compile(r"(<f\b[^>]*?(?:/>|>.*?</f>))\s*<v>.*?</v>", re.S)
+_CELL_T_RE = re.compile(r'\st="[^"]*"')
+CALC_CHAIN = "xl/calcChain.xml"
+_CALC_CHAIN_REL_RE = re.compile(r'<Relationship\b[^>]*Target="(?:/xl/)?calcChain\.xml"[^>]*/>')
+_CALC_CHAIN_TYPE_RE = re.compile(r'<Override\b[^>]*PartName="/xl/calcChain\.xml"[^>]*/>')
+
+
+def _cell_pattern(refs):
+    alternatives = "|".join(re.escape(r) for r in sorted(refs, key=len, reverse=True))
+    return re.compile(
+        rf'<c\b([^>]*?)\sr="({alternatives})"([^>]*?)\s*(?:/>|>.*?</c>)', re.S
+    )
+
+
+def set_cell_texts(sheet_xml: str, values: dict) -> str:
+    """
+    Записывает тексты в ячейки листа {адрес: текст} (как строку, inlineStr);
+    стиль ячейки сохраняется. Ячеек, которых нет в XML, не создаёт.
+    """
+    if not values:
+        return sheet_xml
+
+    def repl(m):
+        attrs = _CELL_T_RE.sub("", m.group(1) + m.group(3))
+        text = escape(values[m.group(2)])
+        return (
+            f'<c r="{m.group(2)}"{attrs} t="inlineStr">'
+            f'<is><t xml:space="preserve">{text}</t></is></c>'
+        )
+
+    return _cell_pattern(values).sub(repl, sheet_xml)
+
+
+def set_cell_numbers(sheet_xml: str, values: dict) -> str:
+    """
+    Записывает числа в ячейки листа {адрес: число}; формула ячейки
+    заменяется значением, стиль сохраняется. Ячеек, которых нет в XML, не создаёт.
+    """
+    if not values:
+        return sheet_xml
+
+    def repl(m):
+        attrs = _CELL_T_RE.sub("", m.group(1) + m.group(3))
+        # 16 значащих цифр — как openpyxl и Excel
+        return f'<c r="{m.group(2)}"{attrs}><v>{float(values[m.group(2)]):.16g}</v></c>'
+
+    return _cell_pattern(values).sub(repl, sheet_xml)
+
+
+def _drop_calc_chain(infos, parts):
+    """Убирает calcChain.xml из частей, связей книги и [Content_Types].xml."""
+    if CALC_CHAIN not in parts:
+        return infos
+    del parts[CALC_CHAIN]
+    rels = "xl/_rels/workbook.xml.rels"
+    if rels in parts:
+        parts[rels] = _CALC_CHAIN_REL_RE.sub("", parts[rels].decode("utf-8")).encode("utf-8")
+    types = "[Content_Types].xml"
+    if types in parts:
+        parts[types] = _CALC_CHAIN_TYPE_RE.sub("", parts[types].decode("utf-8")).encode("utf-8")
+    return [info for info in infos if info.filename != CALC_CHAIN]
+
+
+class TemplateClone:
+    """Шаблон в памяти: части архива, листы и тексты ячеек с тегами."""
+
+    def __init__(self, data: bytes, template_map: dict = None, drop_cached_values: bool = False):
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.infos = zf.infolist()
+            self.parts = {info.filename: zf.read(info) for info in self.infos}
+            self.sheet_parts = dict(sheet_parts(zf)[0])
+
+        # Исходные тексты ячеек с тегами (по карте шаблона)
+        self.cell_texts = {}
+        if template_map is not None:
+            addresses = {(loc["sheet"], loc["cell"]) for loc in template_map["cells"]}
+            self.cell_texts = read_cells(io.BytesIO(data), addresses)
+
+        if drop_cached_values:
+            for part in self.sheet_parts.values():
+                xml = self.parts[part].decode("utf-8")
+                self.parts[part] = _CACHED_VALUE_RE.sub(r"\1", xml).encode("utf-8")
+            self.infos = _drop_calc_chain(self.infos, self.parts)
+            if WORKBOOK in self.parts:
+                xml = self.parts[WORKBOOK].decode("utf-8")
+                self.parts[WORKBOOK] = _force_full_calc(xml).encode("utf-8")
+
+    @property
+    def sheetnames(self):
+        return list(self.sheet_parts)
+
+    def formula_cells(self, addresses) -> set:
+        """Адреса [(лист, 'D13'), ...], в которых в шаблоне стоит формула."""
+        by_sheet = {}
+        for sheet, ref in addresses:
+            by_sheet.setdefault(sheet, set()).add(ref)
+        found = set()
+        for sheet, refs in by_sheet.items():
+            part = self.sheet_parts.get(sheet)
+            if part is None:
+                continue
+            for _, elem in ET.iterparse(io.BytesIO(self.parts[part]), events=("end",)):
+                if elem.tag == f"{NS}c":
+                    if elem.get("r") in refs and elem.find(f"{NS}f") is not None:
+                        found.add((sheet, elem.get("r")))
+                    elem.clear()
+        return found
+
+    def clone(self) -> dict:
+        """Копия частей для одного отчёта; части заменяются, а не изменяются."""
+        return dict(self.parts)
+
+    def set_cells(self, parts: dict, sheet: str, values: dict):
+        """Записывает тексты в ячейки листа sheet в копии parts."""
+        part = self.sheet_parts[sheet]
+        parts[part] = set_cell_texts(parts[part].decode("utf-8"), values).encode("utf-8")
+
+    def set_numbers(self, parts: dict, sheet: str, values: dict):
+        """Записывает числа в ячейки листа sheet в копии parts."""
+        part = self.sheet_parts[sheet]
+        parts[part] = set_cell_numbers(parts[part].decode("utf-8"), values).encode("utf-8")
+
+    def write(self, path, parts: dict):
+        """Атомарная запись отчёта в итоговый путь."""
+        write_parts(path, self.infos, parts)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xlsx_tags.py
+
+Замена текстовых тегов ('[date]', '[number]', ...) прямо в XML книги xlsx,
+без Excel/COM и без полной загрузки книги через openpyxl.
+
+Поведение повторяет Selection.Replace(LookAt=xlPart, MatchCase=False)
+по всем листам:
+  - тег ищется как часть текста ячейки без учёта регистра
+  - если после замены весь текст ячейки — число в записи с десятичной
+    запятой ('33469,12', '0'), ячейка становится числовой, как при вводе в Excel
+  - если текст стал пустым, ячейка очищается (стиль сохраняется)
+Форматирование отдельных фрагментов (rich text) сохраняется, если тег
+целиком лежит внутри одного фрагмента.
+
+После замены в workbook.xml выставляется fullCalcOnLoad, чтобы Excel
+пересчитал формулы при открытии файла.
+"""
+import copy
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape, unescape
+
+SHARED_STRINGS = "xl/sharedStrings.xml"
+WORKBOOK = "xl/workbook.xml"
+
+_SI_RE = re.compile(r"<si(?:>(.*?)</si>|\s*/>)", re.S)
+_T_RE = re.compile(r"(<t(?:\s[^>]*)?>)(.*?)(</t>)", re.S)
+_CELL_RE = re.compile(r"<c\b([^>]*?)>\s*<v>(\d+)</v>\s*</c>")
+_CALC_PR_RE = re.compile(r"<calcPr\b([^>]*?)(/?)>")
+_NUMBER_RE = re.compile(r"-?\d+(?:,\d+)?")
+
+
+def _number_or_none(text: str):
+    """'33469,12' -> 33469.12; всё, что Excel не принял бы за число, -> None."""
+    if _NUMBER_RE.fullmatch(text):
+        return float(text.replace(",", "."))
+    return None
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _tag_pattern(replacements):
+    tags = sorted(replacements, key=len, reverse=True)
+    return re.compile("|".join(re.escape(t) for t in tags), re.IGNORECASE)
+
+
+def _replace_in_shared_strings(xml: str, pattern, lookup, strings=None):
+    """
+    Возвращает (новый xml, {индекс строки: новое значение}) для изменённых строк.
+    Новое значение — float для числовых строк, '' для опустевших, иначе текст.
+    strings — индексы строк с тегами (карта шаблона); остальные не разбираются.
+    """
+    changed = {}
+    parts = []
+    pos = 0
+    for idx, m in enumerate(_SI_RE.finditer(xml)):
+        body = m.group(1)
+        if body is None or (strings is not None and idx not in strings):
+            continue
+        texts = [t.group(2) for t in _T_RE.finditer(body)]
+        full = unescape("".join(texts))
+        if not pattern.search(full):
+            continue
+
+        new_full = pattern.sub(lambda mm: lookup[mm.group(0).lower()], full)
+        new_body = _T_RE.sub(
+            lambda t: t.group(1) + escape(
+                pattern.sub(lambda mm: lookup[mm.group(0).lower()], unescape(t.group(2)))
+            ) + t.group(3),
+            body,
+        )
+        if unescape("".join(t.group(2) for t in _T_RE.finditer(new_body))) != new_full:
+            # Тег разрезан между фрагментами rich text — склеиваем в один
+            new_body = f'<t xml:space="preserve">{escape(new_full)}</t>'
+
+        parts.append(xml[pos:m.start(1)])
+        parts.append(new_body)
+        pos = m.end(1)
+
+        number = _number_or_none(new_full)
+        if number is not None:
+            changed[idx] = number
+        elif new_full == "":
+            changed[idx] = ""
+        else:
+            changed[idx] = new_full
+    parts.append(xml[pos:])
+    return "".join(parts), changed
+
+
+def _convert_cells(sheet_xml: str, converted):
+    """Ссылки на строки, ставшие числом или пустыми, превращает в числовые/пустые ячейки."""
+    def repl(m):
+        attrs, ref = m.group(1), int(m.group(2))
+        if 't="s"' not in attrs or ref not in converted:
+            return m.group(0)
+        attrs = attrs.replace(' t="s"', "")
+        value = converted[ref]
+        if value == "":
+            return f"<c{attrs}/>"
+        return f"<c{attrs}><v>{_format_number(value)}</v></c>"
+
+    return _CELL_RE.sub(repl, sheet_xml)
+
+
+def _force_full_calc(workbook_xml: str) -> str:
+    m = _CALC_PR_RE.search(workbook_xml)
+    if m is None:
+        return workbook_xml.replace("</workbook>", '<calcPr fullCalcOnLoad="1"/></workbook>')
+    if "fullCalcOnLoad" in m.group(1):
+        return workbook_xml
+    return (
+        workbook_xml[:m.start()]
+        + f'<calcPr{m.group(1)} fullCalcOnLoad="1"{m.group(2)}>'
+        + workbook_xml[m.end():]
+    )
+
+
+def replace_tags_in_bytes(data: dict, replacements: dict, template_map: dict = None) -> int:
+    """
+    Заменяет теги в содержимом xlsx, заданном как {имя части: bytes}; части
+    меняются на месте. Возвращает число изменённых строк (0 — тегов не было).
+
+    template_map — карта тегов шаблона (template_compiler): тогда
+    просматриваются только известные строки и листы с тегами. Годится только
+    для клона шаблона: Excel при сохранении отчёта перенумеровывает общие
+    строки, поэтому в готовых файлах просматриваются все строки.
+    """
+    if not replacements or SHARED_STRINGS not in data:
+        return 0
+    pattern = _tag_pattern(replacements)
+    lookup = {tag.lower(): str(value) for tag, value in replacements.items()}
+
+    strings = parts = None
+    if template_map is not None:
+        strings = set(template_map["strings"])
+        parts = set(template_map["parts"])
+    sst, changed = _replace_in_shared_strings(
+        data[SHARED_STRINGS].decode("utf-8"), pattern, lookup, strings
+    )
+    if not changed:
+        return 0
+    data[SHARED_STRINGS] = sst.encode("utf-8")
+
+    converted = {i: v for i, v in changed.items() if not isinstance(v, str) or v == ""}
+    if converted:
+        for name in data:
+            if parts is not None and name not in parts:
+                continue
+            if name.startswith("xl/worksheets/") and name.endswith(".xml"):
+                data[name] = _convert_cells(data[name].decode("utf-8"), converted).encode("utf-8")
+
+    if WORKBOOK in data:
+        data[WORKBOOK] = _force_full_calc(data[WORKBOOK].decode("utf-8")).encode("utf-8")
+    return len(changed)
+
+
+def read_parts(path):
+    """Читает xlsx в память: (список ZipInfo в исходном порядке, {имя: bytes})."""
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+        return infos, {info.filename: zf.read(info) for info in infos}
+
+
+def write_parts(path, infos, data):
+    """
+    Атомарно записывает части книги в path (через временный файл и rename).
+    writestr меняет переданный ZipInfo (CRC, размеры, смещение), поэтому
+    пишется копия: одни и те же infos клона шаблона пишутся из разных потоков.
+    """
+    path = os.fspath(path)
+    tmp = f"{path}.tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        for info in infos:
+            zf.writestr(copy.copy(info), data[info.filename], compress_type=info.compress_type)
+    os.replace(tmp, path)
+
+
+def replace_tags(path, replacements: dict) -> int:
+    """
+    Заменяет теги в файле xlsx на месте (все общие строки: файл мог быть
+    пересохранён в Excel). Файл без тегов не перезаписывается.
+    """
+    infos, data = read_parts(path)
+    count = replace_tags_in_bytes(data, replacements)
+    if count:
+        write_parts(path, infos, data)
+    return count
+
+
+def contains_tags(path, tags) -> bool:
+    """
+    Остались ли в файле теги из tags — в общих строках или в тексте ячеек
+    листов (встроенные строки, которые replace_tags не заменяет).
+    """
+    if not tags:
+        return False
+    pattern = _tag_pattern(tags)
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            if name == SHARED_STRINGS or (name.startswith("xl/worksheets/") and name.endswith(".xml")):
+                if pattern.search(unescape(zf.read(name).decode("utf-8"))):
+                    return True
+    return False
@@ -12,34 +12,328 @@ main_runner.py
     3_situacija.py             (функция fill_situacija_reports_com)
     4_izvedeno.py              (функция main)
     5_kumulativni izveštaj.py  (функция create_kumulativni_izveštaj)
+
+Скриптам передаётся общий контекст (scripts/pipeline_context.py) с журналом,
+сертификатами и шаблонами в памяти; журнал записывается один раз в конце.
+Журнал хранится в templates/journal.sqlite3; с ключом --export-journal
+после выполнения скриптов он выгружается в templates/journal.xlsx.
+
+После запуска рядом с папкой Output пишется run_report.json: время, процессорное
+время и пиковая память по этапам и время открытия/сохранения каждой книги
+(scripts/run_metrics.py). Ключ --profile <этап> (например, --profile 4 или
+--profile 4_izvedeno) выполняет этап под cProfile и сохраняет profile_<этап>.prof,
+--trace-memory добавляет пик выделений Python по этапам (медленнее).
+
+Быстрый старт: тяжёлые библиотеки (pandas, openpyxl, numpy, win32com) импортируют
+только этапы, которым они нужны; байткод скриптов кэшируется в .cache/pycache
+(в том числе в собранном exe, где PyInstaller по умолчанию его не пишет).
+Время импорта каждого этапа и время до первого этапа пишутся в run_report.json.
+
+С ключом --watch раннер не завершается: после полного прогона он следит за
+папкой Input (scripts/input_watcher.py) и для каждого нового сертификата
+запускает этапы 2–5 с уже загруженными скриптами, журналом и шаблонами.
+
+С ключом --projects <папка> ... (или --projects-file) обрабатываются несколько
+проектов со структурой как у matic/ (Input, templates, Output): скрипты берутся
+из scripts рядом с exe, проекты идут параллельно с общим пулом процессов для
+izvedeno, итог — общая сводка batch_summary.json рядом с exe.
+
+Ключ --import-rates <CSV> перед запуском добавляет курсы евро в таблицу
+templates/exchange_rates.csv (scripts/exchange_rates.py): по ней считаются
+курсы и суммы в динарах в журнале и заполняются курсы в situacija.
+
+Ключ --kumulativni <дата> ... (или all — на каждую дату отчётов izvedeno)
+вместо полного прогона строит исторические кумулятивные отчёты по уже
+созданным файлам Output/Izvedeno: по отчёту на дату, за один проход.
+
+Ключ --item-progress <текст> печатает ход позиций, ключ которых содержит текст,
+по всем сертификатам (scripts/line_items.py), не открывая файлы xlsx.
 """
+import time
+_T_START = time.perf_counter()
+
+import os
 import sys
+import json
+import argparse
+import threading
 import traceback
+import multiprocessing
 import importlib.util
+from contextlib import nullcontext
 from pathlib import Path
 
-def load_and_run(script_path: Path, func_name: str):
+# Загруженные модули этапов: в режимах --watch и --projects скрипты импортируются один раз
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+def load_stage(script_path: Path):
+    """Загружает скрипт этапа (один раз за процесс); возвращает (модуль, время импорта)."""
+    with _modules_lock:
+        return _load_stage(script_path)
+
+
+def _load_stage(script_path: Path):
+    module = _modules.get(script_path)
+    if module is not None:
+        return module, 0.0
+    spec = importlib.util.spec_from_file_location(script_path.stem, str(script_path))
+    module = importlib.util.module_from_spec(spec)
+    # Регистрируем модуль под его именем: пул процессов в 4_izvedeno
+    # передаёт функции по имени модуля
+    sys.modules[spec.name] = module
+    t_import = time.perf_counter()
+    spec.loader.exec_module(module)
+    _modules[script_path] = module
+    return module, time.perf_counter() - t_import
+
+
+def run_stage(script_path: Path, func_name: str, ctx=None, report=None, profile=False):
+    """Выполняет один этап; ошибки этапа пробрасываются вызывающему."""
     print(f"\n=== Running: {script_path.name} ===")
     if not script_path.exists():
         print(f"⚠ Skipping missing script: {script_path.name}")
         return
-    try:
-        spec = importlib.util.spec_from_file_location(script_path.stem, str(script_path))
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+    # Замер этапа (время, память, файлы) для run_report.json
+    stage = report.stage(script_path.stem, profile) if report is not None else nullcontext({})
+    with stage as entry:
+        module, import_seconds = load_stage(script_path)
+        entry["import_seconds"] = round(import_seconds, 6)
+        print(f"   import: {import_seconds:.2f} s")
         func = getattr(module, func_name, None)
         if not func:
             raise AttributeError(f"Function '{func_name}' not found in {script_path.name}")
-        func()
-        print(f"✅ {script_path.name} finished successfully.")
-    except Exception as e:
-        print(f"❌ Error in {script_path.name}: {e}")
-        traceback.print_exc()
+        func(ctx)
+    print(f"✅ {script_path.name} finished successfully.")
+
+
+def load_and_run(script_path: Path, func_name: str, ctx=None, report=None, profile=False):
+    try:
+        run_stage(script_path, func_name, ctx, report, profile)
+    except (Exception, SystemExit) as e:
+        # Этапы сообщают о фатальной ошибке и через sys.exit(1)
+        if isinstance(e, SystemExit):
+            print(f"❌ Error in {script_path.name}: exited with code {e.code}")
+        else:
+            print(f"❌ Error in {script_path.name}: {e}")
+            traceback.print_exc()
+        # Сохраняем изменения журнала, сделанные успешными этапами, и отчёт:
+        # иначе отчёты уже созданы, а строк журнала для них нет
+        try:
+            if ctx is not None:
+                ctx.flush()
+        finally:
+            if report is not None:
+                print(f"Run report: {report.save()}")
         input("Press Enter to exit...")
         sys.exit(1)
 
 
+# Этапы, которые затрагивает новый сертификат: 1_journal_update читает только
+# уже созданные situacija, поэтому в режиме --watch после нового файла не нужен
+WATCH_STAGES = ('2_journal.py', '3_situacija.py', '4_izvedeno.py', '5_kumulativni izveštaj.py')
+
+
+def run_batch(root: Path, scripts_dir: Path, stages, ctx):
+    """Прогон этапов в режиме --watch: ошибка этапа не останавливает наблюдение."""
+    from run_metrics import RunReport
+    report = RunReport(root)
+    t0 = time.perf_counter()
+    try:
+        for name, func in stages:
+            run_stage(scripts_dir / name, func, ctx, report)
+    except (Exception, SystemExit) as e:
+        print(f"❌ Error: {e}")
+        traceback.print_exc()
+    finally:
+        with report.stage("journal_flush"):
+            ctx.flush()
+        report.save()
+    print(f"⏱ Done in {time.perf_counter() - t0:.1f} s")
+
+
+def watch(root: Path, scripts_dir: Path, to_run, ctx, debounce: float):
+    """
+    Режим --watch: полный прогон, затем ожидание новых сертификатов в Input.
+    Модули этапов, журнал и шаблоны остаются загруженными между прогонами;
+    изменённые шаблоны и таблица курсов перечитываются (pipeline_context).
+    """
+    from file_cache import file_stamp
+    from input_watcher import InputWatcher
+
+    run_batch(root, scripts_dir, to_run, ctx)
+
+    watch_stages = [(name, func) for name, func in to_run if name in WATCH_STAGES]
+    watcher = InputWatcher(root / 'Input', debounce=debounce)
+    # Файлы, которые 2_journal не смог обработать: повторяем, только если файл изменился
+    failed = {}
+
+    def skip(path: Path) -> bool:
+        if ctx.is_processed(path.name):
+            return True
+        try:
+            return failed.get(path.name) == file_stamp(path)
+        except OSError:
+            return True
+
+    print(f"\n👀 Watching {root / 'Input'} ({watcher.mode}). Press Ctrl+C to stop.")
+    try:
+        while True:
+            new_files = watcher.wait(skip)
+            print(f"\n📥 New certificates: {', '.join(p.name for p in new_files)}")
+            run_batch(root, scripts_dir, watch_stages, ctx)
+            for path in new_files:
+                if not ctx.is_processed(path.name) and path.exists():
+                    failed[path.name] = file_stamp(path)
+            print(f"\n👀 Watching {root / 'Input'} ...")
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        watcher.stop()
+        ctx.flush()
+
+
+class _ThreadOutput:
+    """
+    stdout/stderr для режима --projects: каждый поток проекта пишет в свой
+    лог, остальной вывод идёт в консоль.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def write(self, text):
+        return (getattr(self.local, 'stream', None) or self.default).write(text)
+
+    def flush(self):
+        (getattr(self.local, 'stream', None) or self.default).flush()
+
+
+def run_project(root: Path, scripts_dir: Path, to_run, executor) -> dict:
+    """Все этапы одного проекта в режиме --projects; возвращает его сводку."""
+    from pipeline_context import PipelineContext
+    ctx = PipelineContext(root, executor=executor)
+    summary = {"project": str(root), "status": "ok", "error": None, "stages": {}}
+    t_project = time.perf_counter()
+    rows_before = None
+    for name, func in to_run:
+        t0 = time.perf_counter()
+        try:
+            if rows_before is None and name == '2_journal.py':
+                rows_before = len(ctx.journal_records())
+            run_stage(scripts_dir / name, func, ctx)
+        except (Exception, SystemExit) as e:
+            summary["status"] = "error"
+            if isinstance(e, SystemExit):
+                summary["error"] = f"{name}: exited with code {e.code}, see batch_log.txt"
+            else:
+                summary["error"] = f"{name}: {e}"
+            traceback.print_exc()
+            break
+        finally:
+            summary["stages"][Path(name).stem] = round(time.perf_counter() - t0, 3)
+    ctx.flush()
+    rows_after = len(ctx.journal_records())
+    summary["journal_rows"] = rows_after
+    summary["new_certificates"] = rows_after - (rows_before if rows_before is not None else rows_after)
+    summary["seconds"] = round(time.perf_counter() - t_project, 3)
+    return summary
+
+
+def run_projects(roots, scripts_dir: Path, to_run, summary_path: Path):
+    """
+    Режим --projects: этапы всех проектов выполняются в потоках (по одному
+    на проект), обработка сертификатов izvedeno — в общем пуле процессов.
+    Вывод каждого проекта пишется в <проект>/batch_log.txt, в конце
+    печатается и сохраняется общая сводка.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    workers = int(os.environ.get("MATIC_WORKERS", "0")) or os.cpu_count() or 1
+    out, err = _ThreadOutput(sys.stdout), _ThreadOutput(sys.stderr)
+    console = sys.stdout
+
+    def project_thread(root: Path):
+        with open(root / 'batch_log.txt', 'w', encoding='utf-8') as log:
+            out.local.stream = err.local.stream = log
+            try:
+                summary = run_project(root, scripts_dir, to_run, pool)
+            finally:
+                out.local.stream = err.local.stream = None
+        mark = "✅" if summary["status"] == "ok" else "❌"
+        console.write(f"{mark} {root} ({summary['seconds']:.1f} s)\n")
+        return summary
+
+    print(f"Projects: {len(roots)}, worker processes: {workers}")
+    t0 = time.perf_counter()
+    sys.stdout, sys.stderr = out, err
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, \
+                ThreadPoolExecutor(max_workers=min(len(roots), workers)) as threads:
+            summaries = list(threads.map(project_thread, roots))
+    finally:
+        sys.stdout, sys.stderr = out.default, err.default
+
+    total = round(time.perf_counter() - t0, 3)
+    stage_names = [Path(name).stem for name, _ in to_run]
+    print(f"\n{'project':<40} {'status':<7} {'new':>4} " + " ".join(f"{n[:12]:>12}" for n in stage_names))
+    for summary in summaries:
+        times = " ".join(
+            f"{summary['stages'][n]:>12.2f}" if n in summary['stages'] else f"{'-':>12}"
+            for n in stage_names
+        )
+        print(f"{Path(summary['project']).name[:40]:<40} {summary['status']:<7} "
+              f"{summary['new_certificates']:>4} {times}")
+        if summary["error"]:
+            print(f"    {summary['error']}")
+    print(f"Total: {total:.1f} s")
+
+    summary_path.write_text(
+        json.dumps({"seconds": total, "workers": workers, "projects": summaries},
+                   ensure_ascii=False, indent=2),
+        encoding='utf-8',
+    )
+    print(f"Summary: {summary_path}")
+    return summaries
+
+
+def read_project_list(args) -> list:
+    """Корни проектов из --projects и --projects-file (по одному на строку, # — комментарий)."""
+    roots = [Path(p) for p in args.projects or []]
+    if args.projects_file:
+        for line in Path(args.projects_file).read_text(encoding='utf-8').splitlines():
+            line = line.split('#', 1)[0].strip()
+            if line:
+                roots.append(Path(line))
+    return [r.resolve() for r in roots]
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Matic certificate reports")
+    parser.add_argument("--export-journal", action="store_true",
+                        help="после выполнения выгрузить журнал в templates/journal.xlsx")
+    parser.add_argument("--import-rates", metavar="CSV",
+                        help="перед запуском добавить курсы евро из CSV в templates/exchange_rates.csv")
+    parser.add_argument("--profile", metavar="STAGE",
+                        help="выполнить этап под cProfile (номер или имя скрипта, например 4 или 4_izvedeno)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="записать в отчёт пик выделений Python по этапам (tracemalloc)")
+    parser.add_argument("--watch", action="store_true",
+                        help="не завершаться: следить за папкой Input и обрабатывать новые сертификаты")
+    parser.add_argument("--debounce", type=float, default=2.0, metavar="SECONDS",
+                        help="сколько секунд файл не должен меняться, чтобы считаться записанным (--watch)")
+    parser.add_argument("--projects", nargs="+", metavar="ROOT",
+                        help="обработать несколько проектов (папок со структурой как у matic/) за один запуск")
+    parser.add_argument("--projects-file", metavar="FILE",
+                        help="файл со списком папок проектов, по одной на строку")
+    parser.add_argument("--kumulativni", nargs="+", metavar="DATE",
+                        help="только построить кумулятивные отчёты на даты (дд.мм.гггг) или all — на все даты izvedeno")
+    parser.add_argument("--item-progress", metavar="TEXT",
+                        help="только показать ход позиций, ключ которых содержит TEXT, по всем сертификатам")
+    args = parser.parse_args()
+
     # Определяем корень проекта: папка, где лежит exe (или скрипт в режиме разработки)
     if getattr(sys, 'frozen', False):
         root = Path(sys.executable).resolve().parent
@@ -50,6 +344,40 @@ def main():
     if not scripts_dir.exists():
         print(f"❌ Папка scripts не найдена: {scripts_dir}")
         sys.exit(1)
+    # Скомпилированный байткод скриптов хранится в .cache/pycache и при
+    # следующих запусках загружается без компиляции
+    sys.dont_write_bytecode = False
+    sys.pycache_prefix = str(root / '.cache' / 'pycache')
+    # Вспомогательные модули скриптов импортируются из той же папки
+    sys.path.insert(0, str(scripts_dir))
+
+    if args.import_rates:
+        from exchange_rates import import_rates, rates_path
+        try:
+            count = import_rates(root, Path(args.import_rates))
+        except ValueError as e:
+            # Нераспознанная дата или курс в CSV — сообщение без трассировки
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"💱 Imported {count} exchange rates into {rates_path(root)}")
+
+    if args.kumulativni:
+        from pipeline_context import PipelineContext
+        module, _ = load_stage(scripts_dir / '5_kumulativni izveštaj.py')
+        try:
+            module.create_kumulativni_izveštaj(PipelineContext(root), dates=args.kumulativni)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        return
+
+    if args.item_progress:
+        from pipeline_context import PipelineContext
+        from line_items import print_progress
+        ctx = PipelineContext(root)
+        print_progress(ctx, args.item_progress)
+        ctx.flush()
+        return
 
     # Явный порядок и соответствие функций
     to_run = [
@@ -63,13 +391,50 @@ def main():
     for name, func in to_run:
         print(f"  - {name} -> {func}()")
 
+    if args.projects or args.projects_file:
+        roots = read_project_list(args)
+        if not roots:
+            print(f"❌ Список проектов пуст: {args.projects_file}")
+            sys.exit(1)
+        run_projects(roots, scripts_dir, to_run, root / 'batch_summary.json')
+        return
+
+    # Общий контекст: журнал, сертификаты и шаблоны читаются один раз за запуск
+    from pipeline_context import PipelineContext
+    from run_metrics import RunReport
+    ctx = PipelineContext(root)
+
+    if args.watch:
+        watch(root, scripts_dir, to_run, ctx, args.debounce)
+        return
+
+    report = RunReport(root, trace_memory=args.trace_memory)
+    report.startup_seconds = round(time.perf_counter() - _T_START, 6)
+    print(f"Startup: {report.startup_seconds:.2f} s")
+
     # Последовательно загружаем и выполняем
     for name, func in to_run:
         script_path = scripts_dir / name
-        load_and_run(script_path, func)
+        profile = args.profile is not None and (
+            script_path.stem == args.profile or script_path.stem.split('_')[0] == args.profile
+        )
+        load_and_run(script_path, func, ctx, report, profile)
+
+    # Журнал записывается на диск один раз, в конце
+    with report.stage("journal_flush"):
+        ctx.flush()
+
+    if args.export_journal:
+        from journal_store import export_journal
+        with report.stage("journal_export"):
+            export_journal(root)
+
+    print(f"Run report: {report.save()}")
 
     print("\n🎉 Все скрипты успешно выполнены.")
     input("Press Enter to exit...")
 
 if __name__ == '__main__':
+    # Нужно для пула процессов в собранном exe
+    multiprocessing.freeze_support()
     main()
@@ -6,22 +6,35 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['pandas', 'pandas._libs', 'pandas._libs.tslibs.np_datetime', 'numpy', 'openpyxl', 'win32com', 'win32com.client'],
+    # Скрипты из scripts/ PyInstaller не анализирует: всё, что они импортируют
+    # (в том числе модули стандартной библиотеки, загружаемые по требованию,
+    # как cProfile/pstats для --profile), перечисляется здесь явно
+    hiddenimports=[
+        'pandas', 'pandas._libs', 'pandas._libs.tslibs.np_datetime', 'numpy', 'openpyxl',
+        'win32com', 'win32com.client', 'sqlite3', 'watchdog', 'watchdog.observers', 'watchdog.events',
+        'cProfile', 'profile', 'pstats', 'tracemalloc', 'ctypes', 'ctypes.wintypes',
+        'bisect', 'copy', 'csv', 'hashlib', 'queue', 'concurrent.futures', 'zipfile',
+        'xml.etree.ElementTree', 'xml.sax.saxutils',
+        # Быстрое чтение столбцов сертификата в 2_journal (если пакет установлен при сборке)
+        'python_calamine', 'pandas.io.excel._calamine',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Не используемые скриптами пакеты, которые иначе попадают в сборку через pandas
+    excludes=['tkinter', 'matplotlib', 'IPython', 'notebook', 'pytest', 'scipy'],
     noarchive=False,
     optimize=0,
 )
 pyz = PYZ(a.pure)
 
+# Сборка в папку (onedir): exe не распаковывает pandas/numpy во временную
+# папку при каждом запуске, как в режиме onefile
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='start',
     debug=False,
     bootloader_ignore_signals=False,
@@ -36,3 +49,12 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    name='start',
+)
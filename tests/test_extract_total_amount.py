@@ -0,0 +1,58 @@
+"""
+Регрессия extract_total_amount (2_journal) на примерах сертификатов:
+суммы при чтении столбцов напрямую (read_amount_columns) и из
+нормализованного сертификата контекста (certificate_frame) совпадают.
+"""
+import importlib.util
+import math
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+MATIC = Path(__file__).resolve().parents[1] / "matic"
+SCRIPTS = MATIC / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+from pipeline_context import PipelineContext  # noqa: E402
+
+
+def _load_journal_module():
+    spec = importlib.util.spec_from_file_location("journal_stage", SCRIPTS / "2_journal.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+journal = _load_journal_module()
+
+SAMPLES = [
+    (MATIC / "Input" / "Novi_Sad_Delta_Iron_Progress_certificate_0311-125_11.03.2025.xlsx", 37701.12),
+    (MATIC / "Novi_Sad_Delta_Iron_Progress_certificate_1225_11.04.2025.xlsx", 59824.73),
+]
+
+
+@pytest.mark.parametrize("path, expected", SAMPLES, ids=lambda v: getattr(v, "name", v))
+def test_total_from_amount_columns(path, expected):
+    total = journal.extract_total_amount(path, journal.read_amount_columns(path))
+    assert total == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize("path, expected", SAMPLES, ids=lambda v: getattr(v, "name", v))
+def test_total_from_certificate_frame(tmp_path, path, expected):
+    ctx = PipelineContext(tmp_path)
+    total = journal.extract_total_amount(path, ctx.certificate_frame(path))
+    assert total == pytest.approx(expected, abs=1e-9)
+
+
+def test_parse_amounts_rules():
+    parsed = journal.parse_amounts(pd.Series(["1 234,5", 42.5, None], dtype=object))
+    assert parsed[0] == 12345.0
+    assert parsed[1] == 42.5
+    assert math.isnan(parsed[2])
+
+
+def test_parse_amounts_rejects_text():
+    with pytest.raises(ValueError):
+        journal.parse_amounts(pd.Series(["n/a"], dtype=object))